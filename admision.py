@@ -0,0 +1,181 @@
+"""
+Control de admisión y descarte de carga
+
+Cada petición se clasifica por prioridad según su ruta:
+
+- critica: raíz y health checks, nunca se descartan
+- alta: clima (el endpoint solo rechaza ciudades sin caché si hay sobrecarga)
+- normal: generación de imágenes y descargas
+- baja: listados, variaciones, exportaciones y demás trabajo por lotes
+
+La señal de sobrecarga combina el lag del event loop, las peticiones en curso y
+la cola de generaciones contra Pollinations. El límite de peticiones en curso se
+ajusta solo (AIMD): sube de a poco mientras la latencia está bajo el objetivo y
+baja multiplicativamente cuando lo supera.
+"""
+import asyncio
+import time
+from collections import defaultdict
+
+from config import settings
+from progreso import cola_generaciones
+from respuestas import dumps
+
+# Prefijos de ruta -> prioridad (el primero que coincide gana)
+PRIORIDADES = (
+    ("/api/nivel1/", "alta"),
+    ("/api/nivel2/variaciones", "baja"),
+    ("/api/nivel2/crear-imagen", "normal"),
+    ("/api/nivel3/editar-imagen", "normal"),
+    ("/api/progreso/", "critica"),
+    ("/api/imagenes", "baja"),
+    ("/api/", "normal"),
+)
+RUTAS_CRITICAS = ("/", "/health", "/ready", "/docs", "/openapi.json")
+
+# Rutas que esperan turno en la cola de generaciones
+RUTAS_GENERACION = ("/api/nivel2/crear-imagen", "/api/nivel3/editar-imagen", "/api/nivel2/variaciones")
+
+
+def prioridad_de_ruta(path: str) -> str:
+    if path in RUTAS_CRITICAS or not path.startswith("/api/"):
+        return "critica"
+    for prefijo, prioridad in PRIORIDADES:
+        if path.startswith(prefijo):
+            return prioridad
+    return "normal"
+
+
+class ControlAdmision:
+    """Estado compartido del control de admisión de un worker"""
+
+    def __init__(self):
+        self.limite = float(settings.ADMISION_LIMITE_INICIAL)
+        self.en_curso = 0
+        self.en_curso_por_prioridad = defaultdict(int)
+        self.lag = 0.0
+        self.descartadas = defaultdict(int)
+        self._ultima_reduccion = 0.0
+
+    # ---- Señales ----
+
+    async def medir_lag(self):
+        """Tarea de fondo: mide cuánto se retrasa el event loop (EWMA)"""
+        intervalo = settings.ADMISION_INTERVALO_LAG
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(intervalo)
+            retraso = max(0.0, time.perf_counter() - inicio - intervalo)
+            self.lag = 0.8 * self.lag + 0.2 * retraso
+
+    def sobrecargado(self) -> bool:
+        return self.lag > settings.ADMISION_LAG_MAX or self.en_curso >= self.limite
+
+    # ---- AIMD ----
+
+    def registrar_latencia(self, latencia: float):
+        if latencia <= settings.ADMISION_LATENCIA_OBJETIVO:
+            # Incremento aditivo: +1 por cada "ventana" de peticiones rápidas
+            self.limite = min(settings.ADMISION_LIMITE_MAX, self.limite + 1 / self.limite)
+            return
+        ahora = time.monotonic()
+        # Reducción multiplicativa, como mucho una vez por objetivo de latencia
+        if ahora - self._ultima_reduccion >= settings.ADMISION_LATENCIA_OBJETIVO:
+            self._ultima_reduccion = ahora
+            self.limite = max(settings.ADMISION_LIMITE_MIN, self.limite * 0.9)
+
+    # ---- Decisión ----
+
+    def admitir(self, prioridad: str, path: str) -> bool:
+        if prioridad in ("critica", "alta"):
+            return True
+        if self.lag > settings.ADMISION_LAG_MAX:
+            return False
+        if path.startswith(RUTAS_GENERACION):
+            if cola_generaciones.en_espera >= settings.ADMISION_MAX_COLA:
+                return False
+            # Las variaciones (lotes) solo entran si no hay nadie esperando turno
+            return prioridad != "baja" or cola_generaciones.en_espera == 0
+        if prioridad == "baja":
+            # El trabajo de baja prioridad se corta antes: a la mitad del límite
+            return self.en_curso < self.limite * 0.5
+        return self.en_curso < self.limite
+
+    def estado(self) -> dict:
+        return {
+            "limite": round(self.limite, 2),
+            "en_curso": self.en_curso,
+            "en_curso_por_prioridad": dict(self.en_curso_por_prioridad),
+            "lag_ms": round(self.lag * 1000, 2),
+            "cola_generaciones": cola_generaciones.en_espera,
+            "descartadas": dict(self.descartadas),
+        }
+
+
+control_admision = ControlAdmision()
+
+_RESPUESTA_503 = dumps({"detail": "Servidor sobrecargado, intenta de nuevo más tarde"})
+
+
+class AdmissionMiddleware:
+    """
+    Middleware ASGI de admisión
+
+    Es ASGI puro (no BaseHTTPMiddleware) para contar una petición como en curso
+    hasta que termina de enviarse la respuesta, incluidos los streams. La
+    latencia que alimenta el AIMD es el tiempo hasta el inicio de la respuesta.
+    """
+
+    def __init__(self, app, control: ControlAdmision = control_admision):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        prioridad = prioridad_de_ruta(path)
+        if prioridad == "critica":
+            await self.app(scope, receive, send)
+            return
+
+        control = self.control
+        if not control.admitir(prioridad, path):
+            control.descartadas[prioridad] += 1
+            await send({
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(_RESPUESTA_503)).encode()),
+                    (b"retry-after", str(settings.ADMISION_RETRY_AFTER).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": _RESPUESTA_503})
+            return
+
+        if path.startswith(RUTAS_GENERACION):
+            # Las generaciones tardan lo que tarde Pollinations y ya están
+            # limitadas por la cola: no cuentan para el límite AIMD
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        medida = False
+
+        async def send_medido(mensaje):
+            nonlocal medida
+            if not medida and mensaje["type"] == "http.response.start":
+                medida = True
+                control.registrar_latencia(time.perf_counter() - inicio)
+            await send(mensaje)
+
+        control.en_curso += 1
+        control.en_curso_por_prioridad[prioridad] += 1
+        try:
+            await self.app(scope, receive, send_medido)
+        finally:
+            control.en_curso -= 1
+            control.en_curso_por_prioridad[prioridad] -= 1
@@ -0,0 +1,173 @@
+"""
+Apagado ordenado de un worker
+
+1. Drenaje: al recibir SIGTERM el worker se marca como drenando: /ready
+   responde 503 y las rutas de generación se rechazan con 503 para que el
+   balanceador y los clientes vayan a otro worker. Con APAGADO_ESPERA_LB > 0 el
+   worker sigue atendiendo ese tiempo antes de pasarle la señal a uvicorn.
+2. Espera: las peticiones en curso las espera uvicorn al cerrarse, como mucho
+   APAGADO_PLAZO segundos (timeout_graceful_shutdown; por línea de comandos,
+   --timeout-graceful-shutdown). Recién después corre el shutdown del lifespan,
+   que espera a los trabajos en segundo plano dentro del mismo plazo, contado
+   desde que uvicorn empezó a cerrarse.
+3. Pendientes: los trabajos en segundo plano que no terminaron se guardan en
+   STATE_DIR y los retoma otro worker: al arrancar y, como en un despliegue
+   gradual los workers nuevos arrancan antes de que los viejos terminen de
+   drenar, también cada SALUD_INTERVALO segundos.
+"""
+import asyncio
+import glob
+import json
+import os
+import signal
+import threading
+import time
+from typing import Callable, List
+
+from config import settings
+from admision import RUTAS_GENERACION
+from progreso import tareas_en_segundo_plano
+from respuestas import dumps
+
+
+class Apagado:
+    """Estado de drenaje del worker y persistencia del trabajo sin terminar"""
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self.drenando = False
+        # Momento (monotonic) desde el que corre APAGADO_PLAZO
+        self._inicio_plazo = None
+
+    def iniciar_drenaje(self, espera_lb: float = 0.0):
+        self.drenando = True
+        if self._inicio_plazo is None:
+            self._inicio_plazo = time.monotonic() + espera_lb
+
+    # ---- SIGTERM ----
+
+    def instalar_senal(self, espera_lb: float):
+        """
+        Intercepta SIGTERM para marcar el worker como drenando y pasarle la señal
+        al servidor (uvicorn), de inmediato o después de `espera_lb` segundos. Un
+        segundo SIGTERM se pasa de inmediato.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previo = signal.getsignal(signal.SIGTERM)
+        if not callable(previo):
+            return
+        loop = asyncio.get_running_loop()
+
+        def al_recibir(signum, frame):
+            if self.drenando or espera_lb <= 0:
+                self.iniciar_drenaje()
+                previo(signum, frame)
+                return
+            self.iniciar_drenaje(espera_lb)
+            loop.call_soon_threadsafe(loop.call_later, espera_lb, previo, signum, None)
+
+        signal.signal(signal.SIGTERM, al_recibir)
+
+    # ---- Espera ----
+
+    async def drenar(self, plazo: float) -> List[dict]:
+        """
+        Espera a los trabajos en segundo plano hasta que se cumpla `plazo` desde
+        el inicio del drenaje. Cancela los que no terminaron y devuelve los que se
+        pueden reanudar.
+        """
+        self.iniciar_drenaje()
+        limite = self._inicio_plazo + plazo
+
+        tareas = list(tareas_en_segundo_plano)
+        if tareas:
+            await asyncio.wait(tareas, timeout=max(0.0, limite - time.monotonic()))
+
+        pendientes = []
+        for tarea in tareas:
+            if tarea.done():
+                continue
+            reanudable = tareas_en_segundo_plano.get(tarea)
+            if reanudable is not None:
+                pendientes.append(reanudable)
+            tarea.cancel()
+        if tareas:
+            await asyncio.gather(*tareas, return_exceptions=True)
+        return pendientes
+
+    # ---- Pendientes ----
+
+    def guardar_pendientes(self, pendientes: List[dict]):
+        if not pendientes:
+            return
+        ruta = os.path.join(self.directorio, f"pendientes-{os.getpid()}.json")
+        temporal = ruta + ".part"
+        with open(temporal, "wb") as archivo:
+            archivo.write(dumps(pendientes))
+        os.replace(temporal, ruta)
+
+    def tomar_pendientes(self) -> List[dict]:
+        """
+        Reclama los trabajos guardados por workers anteriores. El rename es
+        atómico: si varios workers arrancan a la vez, cada archivo lo toma uno solo.
+        """
+        pendientes = []
+        for ruta in glob.glob(os.path.join(self.directorio, "pendientes-*.json")):
+            tomado = f"{ruta}.{os.getpid()}.tomado"
+            try:
+                os.rename(ruta, tomado)
+            except OSError:
+                continue
+            try:
+                with open(tomado, "rb") as archivo:
+                    pendientes.extend(json.loads(archivo.read()))
+            except ValueError:
+                pass
+            finally:
+                os.remove(tomado)
+        return pendientes
+
+    async def retomar_periodicamente(self, intervalo: float, reanudar: Callable[[dict], None]):
+        """Tarea de fondo del lifespan: reclama los pendientes que vayan apareciendo"""
+        while True:
+            await asyncio.sleep(intervalo)
+            if self.drenando:
+                continue
+            try:
+                pendientes = await asyncio.to_thread(self.tomar_pendientes)
+            except OSError:
+                continue
+            for pendiente in pendientes:
+                reanudar(pendiente)
+
+
+apagado = Apagado(settings.STATE_DIR)
+
+_RESPUESTA_503 = dumps({"detail": "El servidor se está reiniciando, intenta de nuevo en unos segundos"})
+
+
+class DrenajeMiddleware:
+    """Rechaza nuevas generaciones mientras el worker drena"""
+
+    def __init__(self, app, estado: Apagado = apagado):
+        self.app = app
+        self.estado = estado
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.estado.drenando \
+                or not scope["path"].startswith(RUTAS_GENERACION):
+            await self.app(scope, receive, send)
+            return
+
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(_RESPUESTA_503)).encode()),
+                (b"retry-after", str(settings.ADMISION_RETRY_AFTER).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": _RESPUESTA_503})
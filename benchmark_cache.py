@@ -0,0 +1,61 @@
+"""
+Benchmark de la caché de dos niveles
+
+Simula N workers de uvicorn (procesos) atendiendo consultas de clima con una
+distribución sesgada (Zipf) sobre un conjunto de ciudades, y compara el hit rate
+de usar solo la LRU local de cada proceso frente a LRU local + nivel SQLite
+compartido.
+
+Uso:
+    python benchmark_cache.py
+"""
+import os
+import random
+import tempfile
+from multiprocessing import Pool
+
+from cache import SharedStore, TwoTierCache
+
+CIUDADES = 2000
+PETICIONES_TOTALES = 20000
+MAX_LOCAL = 1024
+
+
+def _worker(args):
+    db_path, usar_compartido, peticiones, semilla = args
+    store = SharedStore(db_path, max_entradas=100000) if usar_compartido else None
+    cache = TwoTierCache("clima", ttl=3600, store=store, max_local=MAX_LOCAL)
+    rnd = random.Random(semilla)
+    pesos = [1 / (i + 1) for i in range(CIUDADES)]
+    ciudades = rnd.choices(range(CIUDADES), weights=pesos, k=peticiones)
+
+    for ciudad in ciudades:
+        clave = f"ciudad-{ciudad}"
+        if cache.get(clave) is None:
+            cache.set(clave, {"ciudad": clave, "temperatura": 20.0})
+    return cache.stats()
+
+
+def ejecutar(workers: int, usar_compartido: bool) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "cache.db")
+        peticiones = PETICIONES_TOTALES // workers
+        args = [(db_path, usar_compartido, peticiones, i) for i in range(workers)]
+        with Pool(workers) as pool:
+            resultados = pool.map(_worker, args)
+
+    hits = sum(r["hits_local"] + r["hits_compartido"] for r in resultados)
+    total = hits + sum(r["misses"] for r in resultados)
+    return hits / total
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("BENCHMARK CACHÉ DE DOS NIVELES")
+    print(f"{CIUDADES} ciudades, {PETICIONES_TOTALES} peticiones, LRU local de {MAX_LOCAL}")
+    print("=" * 60)
+    print(f"{'workers':>8} {'solo local':>12} {'dos niveles':>12} {'ganancia':>10}")
+    for workers in (1, 2, 4, 8):
+        solo_local = ejecutar(workers, usar_compartido=False)
+        dos_niveles = ejecutar(workers, usar_compartido=True)
+        print(f"{workers:>8} {solo_local:>11.1%} {dos_niveles:>11.1%} {dos_niveles - solo_local:>+9.1%}")
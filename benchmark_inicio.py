@@ -0,0 +1,125 @@
+"""
+Benchmark de arranque en frío
+
+1. Perfil de importación: ejecuta `python -X importtime -c "import main"` y muestra
+   los módulos que más tiempo acumulan.
+2. Tiempo hasta la primera petición: lanza uvicorn en un proceso nuevo y mide
+   cuánto tarda en responder `GET /`.
+
+Termina con código 1 si la mediana del tiempo hasta la primera petición supera
+el máximo permitido, para usarlo como control de regresiones.
+
+Uso:
+    python benchmark_inicio.py [--max-ms 1500] [--repeticiones 5]
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+
+def _entorno(tmp: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = RAIZ + os.pathsep + env.get("PYTHONPATH", "")
+    env["STATE_DIR"] = os.path.join(tmp, ".state")
+    return env
+
+
+def perfil_importacion(top: int = 15):
+    """Devuelve (total_ms, [(modulo, acumulado_ms), ...]) de `import main`"""
+    with tempfile.TemporaryDirectory() as tmp:
+        proceso = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=tmp, env=_entorno(tmp), capture_output=True, text=True
+        )
+    if proceso.returncode != 0:
+        raise RuntimeError(proceso.stderr)
+
+    # importtime imprime cada módulo después de sus dependencias, así que los
+    # hijos directos de `main` son las líneas de sangría 3 anteriores a `main`
+    modulos, hijos, total = [], [], 0.0
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "|" not in linea:
+            continue
+        _, acumulado, nombre = linea.split("|")
+        if not acumulado.strip().isdigit():
+            continue
+        sangria = len(nombre) - len(nombre.lstrip())
+        if sangria == 1:
+            if nombre.strip() == "main":
+                total = int(acumulado) / 1000
+                modulos = hijos
+            hijos = []
+        elif sangria == 3:
+            hijos.append((nombre.strip(), int(acumulado) / 1000))
+
+    modulos.sort(key=lambda m: m[1], reverse=True)
+    return total, modulos[:top]
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def tiempo_primera_peticion(timeout: float = 30.0) -> float:
+    """Milisegundos desde lanzar uvicorn hasta la primera respuesta 200 de `/`"""
+    puerto = _puerto_libre()
+    url = f"http://127.0.0.1:{puerto}/"
+    with tempfile.TemporaryDirectory() as tmp:
+        inicio = time.perf_counter()
+        proceso = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(puerto), "--log-level", "warning"],
+            cwd=tmp, env=_entorno(tmp), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while time.perf_counter() - inicio < timeout:
+                try:
+                    with urllib.request.urlopen(url, timeout=1) as response:
+                        if response.status == 200:
+                            return (time.perf_counter() - inicio) * 1000
+                except OSError:
+                    time.sleep(0.01)
+            raise RuntimeError("uvicorn no respondió a tiempo")
+        finally:
+            proceso.terminate()
+            proceso.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-ms", type=float,
+                        default=float(os.getenv("BENCH_MAX_ARRANQUE_MS", "1500")),
+                        help="Máximo permitido para la mediana del tiempo hasta la primera petición")
+    parser.add_argument("--repeticiones", type=int, default=5)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("PERFIL DE IMPORTACIÓN (import main)")
+    print("=" * 60)
+    total, modulos = perfil_importacion()
+    for nombre, ms in modulos:
+        print(f"   {nombre:<40} {ms:>8.1f} ms")
+    print(f"   {'TOTAL':<40} {total:>8.1f} ms")
+    print()
+
+    print("=" * 60)
+    print("TIEMPO HASTA LA PRIMERA PETICIÓN (uvicorn main:app)")
+    print("=" * 60)
+    tiempos = [tiempo_primera_peticion() for _ in range(args.repeticiones)]
+    mediana = statistics.median(tiempos)
+    print(f"   min {min(tiempos):.0f} ms | mediana {mediana:.0f} ms | max {max(tiempos):.0f} ms")
+    print(f"   máximo permitido: {args.max_ms:.0f} ms")
+
+    if mediana > args.max_ms:
+        print("   X REGRESIÓN: el arranque es más lento que el máximo permitido")
+        sys.exit(1)
+    print("   OK")
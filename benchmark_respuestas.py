@@ -0,0 +1,76 @@
+"""
+Microbenchmark de serialización de respuestas
+
+Compara el costo de CPU por petición de una respuesta de nivel 1 servida desde
+caché por dos caminos:
+
+- antes: WeatherResponse(**resultado) -> validación del response_model ->
+  jsonable_encoder -> JSONResponse (json de la librería estándar)
+- ahora: RespuestaJSON(resultado) (orjson directo sobre el dict ya armado)
+
+También compara reconstruir el payload de `/` en cada petición frente a
+reutilizar los bytes precalculados.
+
+Uso:
+    python benchmark_respuestas.py
+"""
+import timeit
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from models import WeatherResponse
+from respuestas import RespuestaJSON, orjson
+import main
+
+RESULTADO = {
+    "ciudad": "Madrid",
+    "pais": "ES",
+    "temperatura": 22.5,
+    "descripcion": "cielo claro",
+    "humedad": 65,
+    "velocidad_viento": 3.5,
+    "hora_local": "2024-10-07 14:30:00",
+    "zona_horaria": "UTC+2",
+}
+REPETICIONES = 20000
+
+
+def clima_antes():
+    modelo = WeatherResponse(**RESULTADO)
+    validado = WeatherResponse.model_validate(modelo.model_dump())
+    return JSONResponse(jsonable_encoder(validado)).body
+
+
+def clima_ahora():
+    return RespuestaJSON(RESULTADO).body
+
+
+def raiz_antes():
+    return JSONResponse(jsonable_encoder(dict(main.INFO_API))).body
+
+
+def raiz_ahora():
+    return RespuestaJSON(main.INFO_API_JSON).body
+
+
+def medir(funcion) -> float:
+    """Microsegundos de CPU por llamada (mejor de 5 rondas)"""
+    tiempos = timeit.repeat(funcion, number=REPETICIONES, repeat=5,
+                            timer=__import__("time").process_time)
+    return min(tiempos) / REPETICIONES * 1e6
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("BENCHMARK SERIALIZACIÓN DE RESPUESTAS")
+    print(f"orjson disponible: {'sí' if orjson is not None else 'no'}")
+    print("=" * 60)
+    for nombre, antes, ahora in (
+        ("nivel1 (hit de caché)", clima_antes, clima_ahora),
+        ("raíz /", raiz_antes, raiz_ahora),
+    ):
+        t_antes, t_ahora = medir(antes), medir(ahora)
+        print(f"{nombre}:")
+        print(f"   antes {t_antes:7.2f} µs | ahora {t_ahora:7.2f} µs | "
+              f"ahorro {t_antes - t_ahora:6.2f} µs por petición ({t_antes / t_ahora:.1f}x)")
@@ -0,0 +1,311 @@
+"""
+Caché de dos niveles compartida entre workers
+
+- Nivel 1: LRU en memoria de cada proceso (sin I/O, el camino más rápido)
+- Nivel 2: tabla SQLite en modo WAL que leen todos los workers del mismo host
+
+Los valores deben ser serializables a JSON. Cada entrada tiene su propio TTL y
+ambos niveles tienen un número máximo de entradas.
+
+El nivel compartido se consulta desde el event loop: si otro worker tiene tomada
+la base más de CACHE_ESPERA_BLOQUEO segundos, la lectura cuenta como miss y la
+escritura se omite. El recorte de entradas corre en segundo plano
+(`recortar_periodicamente`), fuera del camino de las peticiones.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from config import settings
+
+
+class LocalLRU:
+    """LRU en memoria con TTL por entrada"""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave: str, ahora: float):
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            expira, valor = item
+            if expira <= ahora:
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return item
+
+    def peek(self, clave: str, ahora: float):
+        """Como get, pero sin alterar el orden LRU"""
+        item = self._datos.get(clave)
+        if item is None or item[0] <= ahora:
+            return None
+        return item
+
+    def set(self, clave: str, valor: Any, expira: float):
+        with self._lock:
+            self._datos[clave] = (expira, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave: str):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class SharedStore:
+    """
+    Almacén clave/valor con TTL sobre SQLite (WAL), compartido entre procesos
+
+    `get`, `set` y `version` se llaman desde el event loop y esperan la base como
+    mucho `espera_bloqueo` segundos: si sigue tomada, devuelven None o no escriben
+    (y se cuenta en `sin_bloqueo`). Las invalidaciones y el recorte no están en el
+    camino de las peticiones y usan una conexión aparte que sí espera.
+    """
+
+    ESPERA_MANTENIMIENTO = 5.0
+
+    def __init__(self, db_path: str, max_entradas: int, espera_bloqueo: float = 0.05):
+        self.db_path = db_path
+        self.max_entradas = max_entradas
+        self.espera_bloqueo = espera_bloqueo
+        self._local = threading.local()
+        self.sin_bloqueo = 0
+
+    def _abrir(self, espera: float) -> sqlite3.Connection:
+        directorio = os.path.dirname(self.db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=espera, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            " clave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS cache_expira ON cache (expira)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS versiones ("
+            " espacio TEXT PRIMARY KEY, version INTEGER NOT NULL)"
+        )
+        return conn
+
+    def _conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._abrir(self.espera_bloqueo)
+            self._local.conn = conn
+        return conn
+
+    def _conexion_mantenimiento(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "mantenimiento", None)
+        if conn is None:
+            conn = self._abrir(self.ESPERA_MANTENIMIENTO)
+            self._local.mantenimiento = conn
+        return conn
+
+    def get(self, clave: str, ahora: float):
+        try:
+            fila = self._conexion().execute(
+                "SELECT expira, valor FROM cache WHERE clave = ? AND expira > ?", (clave, ahora)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            # Base tomada por otro worker: cuenta como miss
+            self.sin_bloqueo += 1
+            return None
+        if fila is None:
+            return None
+        return fila[0], json.loads(fila[1])
+
+    def set(self, clave: str, valor: Any, expira: float):
+        try:
+            self._conexion().execute(
+                "INSERT OR REPLACE INTO cache (clave, valor, expira) VALUES (?, ?, ?)",
+                (clave, json.dumps(valor, ensure_ascii=False), expira),
+            )
+        except sqlite3.OperationalError:
+            # El valor queda en el nivel local de este worker
+            self.sin_bloqueo += 1
+
+    def recortar(self, ahora: float):
+        """Elimina entradas expiradas y, si sobran, las que expiran antes"""
+        conn = self._conexion_mantenimiento()
+        conn.execute("DELETE FROM cache WHERE expira <= ?", (ahora,))
+        total = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        if total > self.max_entradas:
+            conn.execute(
+                "DELETE FROM cache WHERE clave IN "
+                "(SELECT clave FROM cache ORDER BY expira LIMIT ?)",
+                (total - self.max_entradas,),
+            )
+
+    async def recortar_periodicamente(self, intervalo: float):
+        """Tarea de fondo del lifespan: recorta en un hilo cada `intervalo` segundos"""
+        while True:
+            await asyncio.sleep(intervalo)
+            try:
+                await asyncio.to_thread(self.recortar, time.time())
+            except sqlite3.Error:
+                # Se reintenta en la próxima vuelta
+                pass
+
+    def delete(self, clave: str):
+        self._conexion_mantenimiento().execute("DELETE FROM cache WHERE clave = ?", (clave,))
+
+    def delete_prefijo(self, prefijo: str):
+        self._conexion_mantenimiento().execute(
+            "DELETE FROM cache WHERE substr(clave, 1, ?) = ?", (len(prefijo), prefijo)
+        )
+
+    def version(self, espacio: str) -> Optional[int]:
+        """Versión del espacio, o None si la base está tomada"""
+        try:
+            fila = self._conexion().execute(
+                "SELECT version FROM versiones WHERE espacio = ?", (espacio,)
+            ).fetchone()
+        except sqlite3.OperationalError:
+            self.sin_bloqueo += 1
+            return None
+        return fila[0] if fila else 0
+
+    def incrementar_version(self, espacio: str):
+        self._conexion_mantenimiento().execute(
+            "INSERT INTO versiones (espacio, version) VALUES (?, 1) "
+            "ON CONFLICT(espacio) DO UPDATE SET version = version + 1",
+            (espacio,),
+        )
+
+
+class TwoTierCache:
+    """
+    Caché de un espacio de nombres (ej: "clima") con LRU local + nivel compartido
+
+    Las invalidaciones borran la entrada del nivel compartido e incrementan la
+    versión del espacio; cada proceso revisa esa versión como mucho una vez por
+    segundo y vacía su LRU local si cambió.
+    """
+
+    def __init__(self, espacio: str, ttl: float, store: Optional[SharedStore],
+                 max_local: int = 1024):
+        self.espacio = espacio
+        self.ttl = ttl
+        self.store = store
+        self.local = LocalLRU(max_local)
+        self.hits_local = 0
+        self.hits_compartido = 0
+        self.misses = 0
+        self._version = None
+        self._version_revisada = 0.0
+
+    def _clave(self, clave: str) -> str:
+        return f"{self.espacio}:{clave}"
+
+    def _revisar_version(self, ahora: float):
+        if self.store is None or ahora - self._version_revisada < 1.0:
+            return
+        self._version_revisada = ahora
+        version = self.store.version(self.espacio)
+        if version is None:
+            # Base tomada: se revisa en la próxima vuelta
+            return
+        if self._version is not None and version != self._version:
+            self.local.clear()
+        self._version = version
+
+    def get_with_expiry(self, clave: str):
+        """Devuelve (expira, valor) o None si no está en ningún nivel"""
+        ahora = time.time()
+        self._revisar_version(ahora)
+        clave = self._clave(clave)
+
+        item = self.local.get(clave, ahora)
+        if item is not None:
+            self.hits_local += 1
+            return item
+
+        if self.store is not None:
+            item = self.store.get(clave, ahora)
+            if item is not None:
+                self.hits_compartido += 1
+                self.local.set(clave, item[1], item[0])
+                return item
+
+        self.misses += 1
+        return None
+
+    def expira(self, clave: str) -> Optional[float]:
+        """
+        Momento de expiración de una entrada, o None si no está en caché
+        No cuenta para las estadísticas ni la promueve al nivel local.
+        """
+        ahora = time.time()
+        clave = self._clave(clave)
+        # Otro worker pudo haber renovado la entrada en el nivel compartido
+        candidatos = [self.local.peek(clave, ahora)]
+        if self.store is not None:
+            candidatos.append(self.store.get(clave, ahora))
+        expiraciones = [item[0] for item in candidatos if item is not None]
+        return max(expiraciones) if expiraciones else None
+
+    def get(self, clave: str, default: Any = None) -> Any:
+        item = self.get_with_expiry(clave)
+        return default if item is None else item[1]
+
+    def set(self, clave: str, valor: Any, ttl: Optional[float] = None):
+        expira = time.time() + (self.ttl if ttl is None else ttl)
+        clave = self._clave(clave)
+        self.local.set(clave, valor, expira)
+        if self.store is not None:
+            self.store.set(clave, valor, expira)
+
+    def invalidate(self, clave: str):
+        clave = self._clave(clave)
+        self.local.delete(clave)
+        if self.store is not None:
+            self.store.delete(clave)
+            self.store.incrementar_version(self.espacio)
+
+    def clear(self):
+        self.local.clear()
+        if self.store is not None:
+            self.store.delete_prefijo(self._clave(""))
+            self.store.incrementar_version(self.espacio)
+
+    def stats(self) -> dict:
+        total = self.hits_local + self.hits_compartido + self.misses
+        return {
+            "hits_local": self.hits_local,
+            "hits_compartido": self.hits_compartido,
+            "misses": self.misses,
+            "hit_rate": (self.hits_local + self.hits_compartido) / total if total else 0.0,
+            "entradas_local": len(self.local),
+        }
+
+
+shared_store = SharedStore(
+    db_path=os.path.join(settings.STATE_DIR, "cache.db"),
+    max_entradas=settings.CACHE_SHARED_MAX,
+    espera_bloqueo=settings.CACHE_ESPERA_BLOQUEO,
+) if settings.CACHE_SHARED_ENABLED else None
+
+weather_cache = TwoTierCache("clima", settings.CACHE_TTL_CLIMA, shared_store,
+                             max_local=settings.CACHE_LOCAL_MAX)
+image_cache = TwoTierCache("imagenes", settings.CACHE_TTL_IMAGENES, shared_store,
+                           max_local=settings.CACHE_LOCAL_MAX)
@@ -7,6 +7,18 @@ from dotenv import load_dotenv
 # Cargar variables de entorno
 load_dotenv()
 
+
+def _parse_limite(valor: str):
+    """
+    Convierte "capacidad/segundos" (ej: "30/60") en una tupla (capacidad, periodo)
+    Un valor vacío o "0" desactiva el límite.
+    """
+    if not valor or valor.strip() == "0":
+        return None
+    capacidad, _, periodo = valor.partition("/")
+    return int(capacidad), float(periodo or 60)
+
+
 class Settings:
     """Configuración de la aplicación"""
     
@@ -24,10 +36,105 @@ class Settings:
     # Carpeta para imágenes generadas
     IMAGES_DIR: str = "generated_images"
     
-    def __init__(self):
-        # Crear directorio de imágenes si no existe
-        if not os.path.exists(self.IMAGES_DIR):
-            os.makedirs(self.IMAGES_DIR)
+    # Imágenes fuente del nivel 3, guardadas una vez por hash de contenido
+    FUENTES_DIR: str = os.getenv("FUENTES_DIR", "source_images")
+    FUENTES_MAX_BYTES: int = int(os.getenv("FUENTES_MAX_BYTES", str(20 * 1024 * 1024)))
+    # Tope del almacén de fuentes: se desalojan las usadas hace más tiempo
+    FUENTES_MAX_TOTAL_BYTES: int = int(os.getenv("FUENTES_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+    
+    # Índice de hashes perceptuales de las imágenes (log junto a IMAGES_DIR)
+    SIMILITUD_INDICE: str = os.getenv("SIMILITUD_INDICE", IMAGES_DIR + ".phash")
+    
+    # Carpeta para estado local compartido entre workers (SQLite)
+    STATE_DIR: str = os.getenv("STATE_DIR", ".state")
+    
+    # Caché de dos niveles (LRU por proceso + SQLite compartido entre workers)
+    CACHE_SHARED_ENABLED: bool = os.getenv("CACHE_SHARED_ENABLED", "true").lower() == "true"
+    CACHE_LOCAL_MAX: int = int(os.getenv("CACHE_LOCAL_MAX", "1024"))
+    CACHE_SHARED_MAX: int = int(os.getenv("CACHE_SHARED_MAX", "100000"))
+    CACHE_TTL_CLIMA: float = float(os.getenv("CACHE_TTL_CLIMA", "600"))
+    CACHE_TTL_IMAGENES: float = float(os.getenv("CACHE_TTL_IMAGENES", "86400"))
+    # Segundos máximos esperando la base compartida desde el event loop (si no, miss)
+    CACHE_ESPERA_BLOQUEO: float = float(os.getenv("CACHE_ESPERA_BLOQUEO", "0.05"))
+    # Cada cuántos segundos se recorta el nivel compartido (en segundo plano)
+    CACHE_INTERVALO_RECORTE: float = float(os.getenv("CACHE_INTERVALO_RECORTE", "60"))
+    
+    # Prefetch de las ciudades más consultadas antes de que expiren en caché
+    PREFETCH_ENABLED: bool = os.getenv("PREFETCH_ENABLED", "true").lower() == "true"
+    PREFETCH_TOP_N: int = int(os.getenv("PREFETCH_TOP_N", "50"))
+    PREFETCH_MARGEN: float = float(os.getenv("PREFETCH_MARGEN", "60"))
+    PREFETCH_INTERVALO: float = float(os.getenv("PREFETCH_INTERVALO", "15"))
+    PREFETCH_PRESUPUESTO: int = int(os.getenv("PREFETCH_PRESUPUESTO", "30"))
+    PREFETCH_VIDA_MEDIA: float = float(os.getenv("PREFETCH_VIDA_MEDIA", "1800"))
+    PREFETCH_MAX_CIUDADES: int = int(os.getenv("PREFETCH_MAX_CIUDADES", "5000"))
+    # Accesos esperados durante el TTL para que valga la pena refrescar una ciudad
+    PREFETCH_MIN_ACIERTOS: float = float(os.getenv("PREFETCH_MIN_ACIERTOS", "1"))
+    
+    # Generación de imágenes: concurrencia contra Pollinations y progreso (SSE)
+    MAX_GENERACIONES_CONCURRENTES: int = int(os.getenv("MAX_GENERACIONES_CONCURRENTES", "4"))
+    MAX_VARIACIONES: int = int(os.getenv("MAX_VARIACIONES", "8"))
+    HTTP_MAX_CONEXIONES: int = int(os.getenv("HTTP_MAX_CONEXIONES", "20"))
+    PROGRESO_RETENCION: float = float(os.getenv("PROGRESO_RETENCION", "300"))
+    PROGRESO_KEEPALIVE: float = float(os.getenv("PROGRESO_KEEPALIVE", "15"))
+    # Lado mayor (px) de la vista previa en el modo vista_previa de crear-imagen
+    PREVIEW_LADO: int = int(os.getenv("PREVIEW_LADO", "256"))
+    
+    # Control de admisión: descarte de carga por lag del event loop y concurrencia
+    ADMISION_ENABLED: bool = os.getenv("ADMISION_ENABLED", "true").lower() == "true"
+    ADMISION_LATENCIA_OBJETIVO: float = float(os.getenv("ADMISION_LATENCIA_OBJETIVO", "0.5"))
+    ADMISION_LIMITE_INICIAL: int = int(os.getenv("ADMISION_LIMITE_INICIAL", "64"))
+    ADMISION_LIMITE_MIN: int = int(os.getenv("ADMISION_LIMITE_MIN", "8"))
+    ADMISION_LIMITE_MAX: int = int(os.getenv("ADMISION_LIMITE_MAX", "1024"))
+    ADMISION_LAG_MAX: float = float(os.getenv("ADMISION_LAG_MAX", "0.2"))
+    ADMISION_INTERVALO_LAG: float = float(os.getenv("ADMISION_INTERVALO_LAG", "0.05"))
+    ADMISION_MAX_COLA: int = int(os.getenv("ADMISION_MAX_COLA", "32"))
+    ADMISION_RETRY_AFTER: int = int(os.getenv("ADMISION_RETRY_AFTER", "2"))
+    
+    # Apagado ordenado: plazo para terminar el trabajo en curso (también es el
+    # timeout_graceful_shutdown de uvicorn) y espera tras SIGTERM, marcado como
+    # drenando en /ready, antes de empezar a cerrar
+    APAGADO_PLAZO: float = float(os.getenv("APAGADO_PLAZO", "25"))
+    APAGADO_ESPERA_LB: float = float(os.getenv("APAGADO_ESPERA_LB", "0"))
+    
+    # Sondeos de /ready: servicios externos y espacio libre en IMAGES_DIR
+    SALUD_INTERVALO: float = float(os.getenv("SALUD_INTERVALO", "15"))
+    SALUD_TIMEOUT: float = float(os.getenv("SALUD_TIMEOUT", "5"))
+    SALUD_FALLOS_MAX: int = int(os.getenv("SALUD_FALLOS_MAX", "3"))
+    SALUD_DISCO_MIN_MB: int = int(os.getenv("SALUD_DISCO_MIN_MB", "500"))
+    
+    # Registro de acceso JSON: un archivo para todos los workers, escrito y rotado bajo lock
+    ACCESS_LOG_ENABLED: bool = os.getenv("ACCESS_LOG_ENABLED", "true").lower() == "true"
+    ACCESS_LOG_PATH: str = os.getenv("ACCESS_LOG_PATH", "logs/access.log")
+    ACCESS_LOG_MAX_COLA: int = int(os.getenv("ACCESS_LOG_MAX_COLA", "10000"))
+    ACCESS_LOG_LOTE: int = int(os.getenv("ACCESS_LOG_LOTE", "256"))
+    ACCESS_LOG_MAX_BYTES: int = int(os.getenv("ACCESS_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    ACCESS_LOG_RESPALDOS: int = int(os.getenv("ACCESS_LOG_RESPALDOS", "5"))
+    ACCESS_LOG_MUESTREO: int = int(os.getenv("ACCESS_LOG_MUESTREO", "10"))
+    
+    # Rate limiting por cliente: "capacidad/segundos" por grupo de rutas
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    # API keys reconocidas (separadas por coma): solo estas tienen bucket propio,
+    # cualquier otra X-API-Key se trata como si no se hubiera enviado (se usa la IP)
+    API_KEYS: frozenset = frozenset(
+        clave.strip() for clave in os.getenv("API_KEYS", "").split(",") if clave.strip()
+    )
+    # Segundos máximos esperando la base compartida antes de dejar pasar la petición
+    RATE_LIMIT_ESPERA_BLOQUEO: float = float(os.getenv("RATE_LIMIT_ESPERA_BLOQUEO", "0.05"))
+    RATE_LIMITS: dict = {
+        "clima": _parse_limite(os.getenv("RATE_LIMIT_CLIMA", "60/60")),
+        "crear": _parse_limite(os.getenv("RATE_LIMIT_CREAR", "5/60")),
+        "editar": _parse_limite(os.getenv("RATE_LIMIT_EDITAR", "5/60")),
+        "lectura": _parse_limite(os.getenv("RATE_LIMIT_LECTURA", "120/60")),
+    }
+    
+    def preparar_directorios(self):
+        """
+        Crea los directorios de trabajo si no existen
+        Se llama al arrancar la aplicación (lifespan), no al importar el módulo.
+        """
+        os.makedirs(self.IMAGES_DIR, exist_ok=True)
+        os.makedirs(self.STATE_DIR, exist_ok=True)
+        os.makedirs(self.FUENTES_DIR, exist_ok=True)
 
 settings = Settings()
 
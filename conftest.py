@@ -0,0 +1,103 @@
+"""
+Fixtures compartidas de las pruebas (pytest)
+
+Cada prueba corre en su propio directorio temporal: todas las rutas de la
+configuración (IMAGES_DIR, STATE_DIR, FUENTES_DIR, logs) son relativas, así que
+la API escribe ahí y no en el repositorio. Los servicios externos se simulan:
+Pollinations y OpenWeather responden desde un httpx.MockTransport y requests.get.
+"""
+import io
+import json
+
+import httpx
+import pytest
+
+# test_api.py es un script contra un servidor en marcha, no una prueba de pytest
+collect_ignore = ["test_api.py"]
+
+
+def _png(color: str = "red") -> bytes:
+    from PIL import Image
+
+    salida = io.BytesIO()
+    Image.new("RGB", (64, 64), color).save(salida, "PNG")
+    return salida.getvalue()
+
+
+CLIMA_OPENWEATHER = {
+    "name": "Bogotá",
+    "sys": {"country": "CO"},
+    "main": {"temp": 14.2, "humidity": 80},
+    "weather": [{"description": "nubes"}],
+    "wind": {"speed": 2.1},
+    "timezone": -18000,
+}
+
+
+class _RespuestaRequests:
+    """Lo mínimo de requests.Response que usa ImageService._descargar_imagen"""
+
+    def __init__(self, contenido: bytes):
+        self.status_code = 200
+        self.headers = {"Content-Length": str(len(contenido))}
+        self._contenido = contenido
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, chunk_size: int):
+        for inicio in range(0, len(self._contenido), chunk_size):
+            yield self._contenido[inicio:inicio + chunk_size]
+
+
+@pytest.fixture
+def png() -> bytes:
+    return _png()
+
+
+@pytest.fixture
+def externos(monkeypatch, tmp_path):
+    """Simula Pollinations y OpenWeather; devuelve las URLs pedidas"""
+    import services
+
+    pedidas = []
+    imagen = _png()
+
+    def responder(request: httpx.Request) -> httpx.Response:
+        pedidas.append(str(request.url))
+        if request.url.host == "api.openweathermap.org":
+            return httpx.Response(200, content=json.dumps(CLIMA_OPENWEATHER).encode())
+        return httpx.Response(200, content=imagen)
+
+    def requests_get(url, **kwargs):
+        pedidas.append(url)
+        return _RespuestaRequests(imagen)
+
+    monkeypatch.setattr(services, "_cliente_http", httpx.AsyncClient(transport=httpx.MockTransport(responder)))
+    monkeypatch.setattr("requests.get", requests_get)
+    return pedidas
+
+
+@pytest.fixture
+def cliente(monkeypatch, tmp_path, externos):
+    """TestClient con el lifespan corriendo, en un directorio temporal"""
+    from fastapi.testclient import TestClient
+
+    import main
+    from apagado import apagado
+    from config import settings
+    from rate_limit import RateLimiter
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "OPENWEATHER_API_KEY", "clave-de-prueba")
+    monkeypatch.setattr(settings, "SALUD_DISCO_MIN_MB", 0)
+    # Buckets nuevos por prueba (la base queda en el directorio temporal)
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(str(tmp_path / "rate_limit.db"), settings.RATE_LIMITS))
+    # El shutdown del lifespan de la prueba anterior dejó el worker drenando
+    apagado.drenando = False
+    apagado._inicio_plazo = None
+    with TestClient(main.app) as cliente:
+        yield cliente
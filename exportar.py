@@ -0,0 +1,116 @@
+"""
+Exportación de imágenes como ZIP generado al vuelo
+
+El archivo se arma con zipfile sobre una salida no seekable y se entrega en
+bloques a medida que se escribe: no se carga ninguna imagen completa en
+memoria (solo los metadatos de cada entrada que zipfile necesita para el
+directorio central). Los formatos ya comprimidos (PNG, WebP, JPEG) se guardan
+sin volver a comprimir.
+"""
+import io
+import os
+import zipfile
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+from config import settings
+
+EXTENSIONES_IMAGEN = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+# Estas ya vienen comprimidas: se guardan (ZIP_STORED) en vez de deflate
+EXTENSIONES_COMPRIMIDAS = ('.png', '.jpg', '.jpeg', '.webp')
+TAMANO_BLOQUE = 64 * 1024
+
+
+class _SalidaEnBloques(io.RawIOBase):
+    """Destino de zipfile que acumula lo escrito hasta que se retira"""
+
+    def __init__(self):
+        self._bloques = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self._bloques.append(bytes(datos))
+        return len(datos)
+
+    def retirar(self) -> bytes:
+        datos = b"".join(self._bloques)
+        self._bloques.clear()
+        return datos
+
+
+def seleccionar_imagenes(tipo: Optional[str] = None,
+                         desde: Optional[datetime] = None,
+                         hasta: Optional[datetime] = None,
+                         archivos: Optional[List[str]] = None) -> Iterator[os.DirEntry]:
+    """
+    Recorre IMAGES_DIR de forma perezosa y entrega las imágenes que cumplen el filtro
+
+    - tipo: prefijo del nombre (generated, edited, variation, ...)
+    - desde / hasta: rango de fecha de modificación
+    - archivos: lista explícita de nombres
+    """
+    if not os.path.isdir(settings.IMAGES_DIR):
+        return
+    nombres = set(archivos) if archivos else None
+    desde_ts = desde.timestamp() if desde else None
+    hasta_ts = hasta.timestamp() if hasta else None
+
+    with os.scandir(settings.IMAGES_DIR) as entradas:
+        for entrada in entradas:
+            nombre = entrada.name
+            if not nombre.lower().endswith(EXTENSIONES_IMAGEN) or not entrada.is_file():
+                continue
+            if nombres is not None and nombre not in nombres:
+                continue
+            if tipo and not nombre.startswith(f"{tipo}_"):
+                continue
+            if desde_ts is not None or hasta_ts is not None:
+                modificado = entrada.stat().st_mtime
+                if desde_ts is not None and modificado < desde_ts:
+                    continue
+                if hasta_ts is not None and modificado > hasta_ts:
+                    continue
+            yield entrada
+
+
+def generar_zip(entradas: Iterable[os.DirEntry]) -> Iterator[bytes]:
+    """
+    Genera el ZIP en bloques de como mucho ~TAMANO_BLOQUE bytes
+
+    Es un generador síncrono: StreamingResponse lo itera en el threadpool, así
+    que la lectura de disco y la compresión no bloquean el event loop.
+    """
+    salida = _SalidaEnBloques()
+    with zipfile.ZipFile(salida, mode="w", allowZip64=True) as zf:
+        for entrada in entradas:
+            try:
+                stat = entrada.stat()
+                origen = open(entrada.path, "rb")
+            except OSError:
+                # La imagen pudo borrarse mientras se exportaba
+                continue
+            with origen:
+                info = zipfile.ZipInfo(entrada.name, date_time=datetime.fromtimestamp(stat.st_mtime).timetuple()[:6])
+                info.external_attr = 0o644 << 16
+                if entrada.name.lower().endswith(EXTENSIONES_COMPRIMIDAS):
+                    info.compress_type = zipfile.ZIP_STORED
+                else:
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                with zf.open(info, mode="w", force_zip64=stat.st_size > 0x7FFFFFFF) as destino:
+                    while True:
+                        bloque = origen.read(TAMANO_BLOQUE)
+                        if not bloque:
+                            break
+                        destino.write(bloque)
+                        datos = salida.retirar()
+                        if datos:
+                            yield datos
+            datos = salida.retirar()
+            if datos:
+                yield datos
+    # Directorio central
+    datos = salida.retirar()
+    if datos:
+        yield datos
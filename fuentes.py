@@ -0,0 +1,142 @@
+"""
+Almacén de imágenes fuente del nivel 3, direccionado por contenido
+
+Cada imagen subida se identifica por el SHA-256 de su contenido. Starlette ya
+guardó el upload en un archivo temporal al parsear el formulario; el hash se
+calcula leyéndolo por bloques y solo si no existe una fuente con ese hash se
+copia a FUENTES_DIR. Las dimensiones se leen de la cabecera del PNG, sin
+decodificar los píxeles.
+
+El almacén está acotado a FUENTES_MAX_TOTAL_BYTES: después de guardar una fuente
+nueva se borran las de mtime más antiguo hasta volver bajo el tope. Reutilizar
+una fuente (re-subirla o editarla por `id_fuente`) le actualiza el mtime, así que
+las que se siguen usando no se desalojan.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+from config import settings
+
+ID_FUENTE_VALIDO = re.compile(r"^[0-9a-f]{64}$")
+TAMANO_BLOQUE = 64 * 1024
+
+
+class UploadDemasiadoGrande(Exception):
+    """El upload supera FUENTES_MAX_BYTES"""
+
+
+class AlmacenFuentes:
+    """Fuentes guardadas como `<sha256>.png` en FUENTES_DIR"""
+
+    def __init__(self, directorio: str, max_bytes: int, max_total_bytes: int):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.max_total_bytes = max_total_bytes
+        self.escrituras_evitadas = 0
+        self.desalojadas = 0
+
+    def ruta(self, id_fuente: str) -> str:
+        return os.path.join(self.directorio, f"{id_fuente}.png")
+
+    def existe(self, id_fuente: str) -> bool:
+        return bool(ID_FUENTE_VALIDO.match(id_fuente)) and os.path.exists(self.ruta(id_fuente))
+
+    def tocar(self, id_fuente: str):
+        """Marca la fuente como usada ahora (mtime) para que el recorte la conserve"""
+        try:
+            os.utime(self.ruta(id_fuente))
+        except OSError:
+            pass
+
+    async def guardar_upload(self, upload) -> tuple:
+        """
+        Guarda un UploadFile y devuelve (id_fuente, reutilizada, tamaño en bytes)
+
+        Primero se calcula el hash leyendo el upload por bloques; solo si la
+        fuente no existe se copia a disco.
+        """
+        hasher = hashlib.sha256()
+        tamano = 0
+        while True:
+            bloque = await upload.read(TAMANO_BLOQUE)
+            if not bloque:
+                break
+            tamano += len(bloque)
+            if tamano > self.max_bytes:
+                raise UploadDemasiadoGrande(f"La imagen supera el máximo de {self.max_bytes} bytes")
+            hasher.update(bloque)
+
+        id_fuente = hasher.hexdigest()
+        destino = self.ruta(id_fuente)
+        if os.path.exists(destino):
+            self.escrituras_evitadas += 1
+            self.tocar(id_fuente)
+            return id_fuente, True, tamano
+
+        await upload.seek(0)
+        await asyncio.to_thread(self._copiar, upload.file, destino)
+        return id_fuente, False, tamano
+
+    def _copiar(self, origen, destino: str):
+        os.makedirs(self.directorio, exist_ok=True)
+        # Escritura atómica: otro worker puede estar guardando la misma fuente
+        temporal = f"{destino}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(temporal, "wb") as salida:
+                shutil.copyfileobj(origen, salida, TAMANO_BLOQUE)
+            os.replace(temporal, destino)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        self.recortar(conservar=destino)
+
+    def recortar(self, conservar: str = None):
+        """Borra las fuentes usadas hace más tiempo hasta quedar bajo max_total_bytes"""
+        fuentes = []
+        total = 0
+        with os.scandir(self.directorio) as entradas:
+            for entrada in entradas:
+                if not entrada.name.endswith(".png"):
+                    continue
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                fuentes.append((info.st_mtime, info.st_size, entrada.path))
+                total += info.st_size
+        if total <= self.max_total_bytes:
+            return
+        for _, tamano, ruta in sorted(fuentes):
+            if total <= self.max_total_bytes:
+                break
+            if ruta == conservar:
+                continue
+            try:
+                os.remove(ruta)
+            except OSError:
+                # Ya la borró otro worker
+                pass
+            total -= tamano
+            self.desalojadas += 1
+
+    def metadatos(self, id_fuente: str) -> dict:
+        """Ancho y alto leídos de la cabecera (Image.open no decodifica los píxeles)"""
+        try:
+            from PIL import Image
+
+            with Image.open(self.ruta(id_fuente)) as imagen:
+                ancho, alto = imagen.size
+        except Exception:
+            ancho = alto = None
+        return {"ancho": ancho, "alto": alto}
+
+
+almacen_fuentes = AlmacenFuentes(
+    directorio=settings.FUENTES_DIR,
+    max_bytes=settings.FUENTES_MAX_BYTES,
+    max_total_bytes=settings.FUENTES_MAX_TOTAL_BYTES,
+)
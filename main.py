@@ -7,28 +7,128 @@ Niveles:
 2. Crear una imagen según el prompt ingresado  
 3. Editar una imagen según el prompt de indicaciones dadas
 """
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime
 from typing import Optional
+import asyncio
 import os
+import random
+import re
+import time
 
 from models import (
     WeatherRequest, WeatherResponse,
     ImageCreateRequest, ImageCreateResponse,
-    ImageEditRequest, ImageEditResponse,
+    VariationRequest, VariationResult,
+    ExportRequest,
+    ImageEditRequest, ImageEditResponse, SourceUploadResponse,
     ErrorResponse
 )
-from services import WeatherService, ImageService
+from services import WeatherService, ImageService, cerrar_cliente_http
 from config import settings
+from rate_limit import rate_limiter, grupo_de_ruta, identificar_cliente
+from respuestas import RespuestaJSON, dumps
+from progreso import broker, cola_generaciones, ejecutar_con_progreso, en_segundo_plano, nuevo_id, ID_VALIDO
+from prefetch import frecuencia_ciudades, prefetch_clima
+from admision import AdmissionMiddleware, control_admision
+from cache import weather_cache, shared_store
+from exportar import seleccionar_imagenes, generar_zip
+from similitud import indice_similitud, HASH_BITS
+from fuentes import almacen_fuentes, UploadDemasiadoGrande
+from registro import AccessLogMiddleware, registro_acceso, anotar
+from metricas import tiempo_primer_pixel
+from apagado import DrenajeMiddleware, apagado
+from salud import SaludMiddleware, salud
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Preparación al arrancar cada worker y apagado ordenado al detenerlo"""
+    settings.preparar_directorios()
+    if settings.ACCESS_LOG_ENABLED:
+        registro_acceso.iniciar()
+    apagado.instalar_senal(settings.APAGADO_ESPERA_LB)
+    
+    tareas = []
+    # Cargar el índice de similitud (e indexar imágenes previas) sin bloquear el arranque
+    tareas.append(asyncio.create_task(asyncio.to_thread(indice_similitud.cargar)))
+    # Recorte del nivel compartido de la caché, fuera del camino de las peticiones
+    if shared_store is not None:
+        tareas.append(asyncio.create_task(shared_store.recortar_periodicamente(settings.CACHE_INTERVALO_RECORTE)))
+    # Sondeos de servicios externos y disco para /ready
+    tareas.append(asyncio.create_task(salud.ejecutar()))
+    if settings.ADMISION_ENABLED:
+        tareas.append(asyncio.create_task(control_admision.medir_lag()))
+    if settings.PREFETCH_ENABLED and settings.PREFETCH_PRESUPUESTO > 0 and settings.OPENWEATHER_API_KEY:
+        tareas.append(asyncio.create_task(prefetch_clima.ejecutar()))
+    # Retomar el trabajo que otro worker dejó sin terminar al apagarse: ahora y
+    # periódicamente (en un despliegue gradual los viejos drenan después)
+    for pendiente in apagado.tomar_pendientes():
+        _reanudar(pendiente)
+    tareas.append(asyncio.create_task(apagado.retomar_periodicamente(settings.SALUD_INTERVALO, _reanudar)))
+    
+    yield
+    
+    # uvicorn ya esperó las peticiones en curso: esperar (con plazo) el trabajo en segundo plano
+    pendientes = await apagado.drenar(settings.APAGADO_PLAZO)
+    apagado.guardar_pendientes(pendientes)
+    
+    for tarea in tareas:
+        tarea.cancel()
+        with suppress(asyncio.CancelledError):
+            await tarea
+    await cerrar_cliente_http()
+    # Último paso: escribir los registros de acceso pendientes
+    await asyncio.to_thread(registro_acceso.detener)
+
 
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="API Multi Nivel",
     description="API con 3 niveles: Clima/Hora, Creación de Imágenes y Edición de Imágenes",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=RespuestaJSON
 )
 
+# Rate limiting por cliente (token bucket compartido entre workers)
+@app.middleware("http")
+async def limitar_tasa(request: Request, call_next):
+    """Aplica el token bucket del cliente según el grupo de la ruta"""
+    if not settings.RATE_LIMIT_ENABLED:
+        return await call_next(request)
+    
+    grupo = grupo_de_ruta(request.method, request.url.path)
+    if grupo is None:
+        return await call_next(request)
+    
+    cliente = identificar_cliente(
+        request.headers.get("x-api-key"),
+        request.client.host if request.client else None
+    )
+    resultado = rate_limiter.consumir(grupo, cliente)
+    if resultado is None:
+        return await call_next(request)
+    
+    if not resultado.permitido:
+        return JSONResponse(
+            status_code=429,
+            content={"detail": "Demasiadas solicitudes, intenta de nuevo más tarde"},
+            headers=resultado.headers()
+        )
+    
+    response = await call_next(request)
+    response.headers.update(resultado.headers())
+    return response
+
+
+# Control de admisión: descarta primero el trabajo de baja prioridad con 503
+if settings.ADMISION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -38,39 +138,69 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Drenaje: rechaza nuevas generaciones mientras el worker se apaga
+app.add_middleware(DrenajeMiddleware)
+
+# Registro de acceso: por fuera del resto, para incluir también los 429 y 503
+if settings.ACCESS_LOG_ENABLED:
+    app.add_middleware(AccessLogMiddleware)
+
+# /health y /ready: el más externo, se responden sin pasar por nada más
+app.add_middleware(SaludMiddleware)
+
 # Instanciar servicios
 weather_service = WeatherService()
 
 
+# Payload estático de la raíz, serializado una sola vez al importar
+INFO_API = {
+    "mensaje": "Bienvenido a la API Multi Nivel",
+    "Autor": "David Santiago Ruiz Patarroyo",
+    "Correo": "davidsantiagoruiz@ucompensar.edu.co",
+    "version": "1.0.0",
+    "niveles": [
+        {
+            "nivel": 1,
+            "nombre": "Clima y Hora",
+            "endpoint": "/api/nivel1/clima",
+            "descripcion": "Obtiene el clima y la hora según la ciudad ingresada"
+        },
+        {
+            "nivel": 2,
+            "nombre": "Crear Imagen",
+            "endpoint": "/api/nivel2/crear-imagen",
+            "descripcion": "Crea una imagen según el prompt ingresado"
+        },
+        {
+            "nivel": 3,
+            "nombre": "Editar Imagen",
+            "endpoint": "/api/nivel3/editar-imagen",
+            "descripcion": "Edita una imagen según el prompt de indicaciones dadas"
+        }
+    ]
+}
+INFO_API_JSON = RespuestaJSON(INFO_API).body
+
+
 @app.get("/")
 async def root():
     """Endpoint raíz con información de la API"""
-    return {
-        "mensaje": "Bienvenido a la API Multi Nivel",
-        "Autor": "David Santiago Ruiz Patarroyo",
-        "Correo": "davidsantiagoruiz@ucompensar.edu.co",
-        "version": "1.0.0",
-        "niveles": [
-            {
-                "nivel": 1,
-                "nombre": "Clima y Hora",
-                "endpoint": "/api/nivel1/clima",
-                "descripcion": "Obtiene el clima y la hora según la ciudad ingresada"
-            },
-            {
-                "nivel": 2,
-                "nombre": "Crear Imagen",
-                "endpoint": "/api/nivel2/crear-imagen",
-                "descripcion": "Crea una imagen según el prompt ingresado"
-            },
-            {
-                "nivel": 3,
-                "nombre": "Editar Imagen",
-                "endpoint": "/api/nivel3/editar-imagen",
-                "descripcion": "Edita una imagen según el prompt de indicaciones dadas"
-            }
-        ]
-    }
+    return RespuestaJSON(INFO_API_JSON)
+
+
+TAMANO_VALIDO = re.compile(r"^\d{1,4}x\d{1,4}$")
+
+
+def _validar_id_progreso(id_progreso: Optional[str]) -> str:
+    """Devuelve el id de progreso recibido o uno nuevo si no se envió"""
+    if id_progreso is None:
+        return nuevo_id()
+    if not ID_VALIDO.match(id_progreso):
+        raise HTTPException(
+            status_code=400,
+            detail="id_progreso solo admite letras, números, '_' y '-' (máximo 64)"
+        )
+    return id_progreso
 
 
 # ============================================
@@ -92,9 +222,22 @@ async def obtener_clima(request: WeatherRequest):
     - Hora local de la ciudad
     - Zona horaria
     """
+    clave = WeatherService.clave_ciudad(request.ciudad)
+    if settings.ADMISION_ENABLED and control_admision.sobrecargado() and weather_cache.expira(clave) is None:
+        # Bajo sobrecarga solo se atienden ciudades que ya están en caché
+        control_admision.descartadas["clima_sin_cache"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Servidor sobrecargado, intenta de nuevo más tarde",
+            headers={"Retry-After": str(settings.ADMISION_RETRY_AFTER)}
+        )
+    
     try:
         resultado = await weather_service.get_weather_and_time(request.ciudad)
-        return WeatherResponse(**resultado)
+        frecuencia_ciudades.registrar(clave, request.ciudad)
+        # El servicio ya arma el dict con los campos de WeatherResponse:
+        # se serializa directo sin validarlo de nuevo con pydantic
+        return RespuestaJSON(resultado)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
@@ -113,6 +256,10 @@ async def crear_imagen(request: ImageCreateRequest):
     - **prompt**: Descripción de la imagen que deseas generar
     - **size**: Tamaño de la imagen (cualquier tamaño WxH, ej: 1024x1024, 512x512, 1024x1792)
     - **quality**: Calidad de la imagen (standard, hd) - nota: en versión gratuita se usa calidad mejorada por defecto
+    - **id_progreso**: (Opcional) Id para seguir el progreso en `GET /api/progreso/{id_progreso}`
+    - **vista_previa**: (Opcional) Responde en cuanto hay una vista previa pequeña con la misma
+      semilla; la imagen completa se genera en segundo plano y la reemplaza
+    - **semilla**: (Opcional) Semilla de la generación
     
     ✨ COMPLETAMENTE GRATIS - Sin límites ni API keys necesarias
     
@@ -120,31 +267,173 @@ async def crear_imagen(request: ImageCreateRequest):
     - URL de la imagen generada
     - Nombre del archivo guardado localmente
     """
+    inicio = time.perf_counter()
+    id_progreso = _validar_id_progreso(request.id_progreso)
+    if request.vista_previa:
+        if not TAMANO_VALIDO.match(request.size or ""):
+            raise HTTPException(status_code=400, detail="size debe tener el formato WxH (ej: 1024x1024)")
+        return await _crear_con_vista_previa(request, id_progreso, inicio)
+    
     try:
         image_service = ImageService()
-        resultado = image_service.create_image(
+        resultado = await ejecutar_con_progreso(
+            id_progreso,
+            image_service.create_image,
             prompt=request.prompt,
             size=request.size,
-            quality=request.quality
+            quality=request.quality,
+            seed=request.semilla
         )
+        _registrar_primer_pixel("completa", inicio)
         
-        return ImageCreateResponse(
-            mensaje="Imagen generada exitosamente",
-            prompt=request.prompt,
-            url_imagen=resultado["url_imagen"],
-            nombre_archivo=resultado["nombre_archivo"]
-        )
+        return RespuestaJSON({
+            "mensaje": "Imagen generada exitosamente",
+            "prompt": request.prompt,
+            "url_imagen": resultado["url_imagen"],
+            "nombre_archivo": resultado["nombre_archivo"],
+            "id_progreso": id_progreso,
+            "vista_previa": False,
+            "semilla": request.semilla
+        })
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al crear imagen: {str(e)}")
 
 
+def _registrar_primer_pixel(modo: str, inicio: float):
+    segundos = time.perf_counter() - inicio
+    tiempo_primer_pixel[modo].registrar(segundos)
+    anotar(ttfp_ms=round(segundos * 1000, 2))
+
+
+async def _crear_con_vista_previa(request: ImageCreateRequest, id_progreso: str, inicio: float):
+    """
+    Genera la vista previa (ocupa un cupo de la cola de generaciones, pero pasa
+    antes que las generaciones normales en espera) y deja la imagen completa como
+    tarea en segundo plano. El cliente sigue la imagen completa en
+    `/api/progreso/{id_progreso}`.
+    """
+    semilla = request.semilla if request.semilla is not None else random.randint(0, 2**31 - 1)
+    image_service = ImageService()
+    await cola_generaciones.entrar(broker.publicador(id_progreso), prioritaria=True)
+    try:
+        previa = await asyncio.to_thread(image_service.create_preview, request.prompt, request.size, semilla)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al crear imagen: {str(e)}")
+    finally:
+        cola_generaciones.salir()
+    _registrar_primer_pixel("vista_previa", inicio)
+    broker.publicar(id_progreso, {"estado": "vista_previa", "nombre_archivo": previa["nombre_archivo"]})
+    
+    pendiente = {
+        "tipo": "vista_previa",
+        "id_progreso": id_progreso,
+        "prompt": request.prompt,
+        "size": request.size,
+        "quality": request.quality,
+        "semilla": semilla,
+        "vista_previa": previa["nombre_archivo"],
+        "ruta_local": previa["ruta_local"]
+    }
+    en_segundo_plano(_completar_vista_previa(pendiente), reanudable=pendiente)
+    
+    return RespuestaJSON({
+        "mensaje": "Vista previa generada, la imagen completa se está generando",
+        "prompt": request.prompt,
+        "url_imagen": previa["url_imagen"],
+        "nombre_archivo": previa["nombre_archivo"],
+        "id_progreso": id_progreso,
+        "vista_previa": True,
+        "semilla": semilla
+    })
+
+
+async def _completar_vista_previa(pendiente: dict):
+    """Genera la imagen completa y la deja en lugar de la vista previa"""
+    try:
+        resultado = await ejecutar_con_progreso(
+            pendiente["id_progreso"],
+            ImageService().create_image,
+            prompt=pendiente["prompt"],
+            size=pendiente["size"],
+            quality=pendiente["quality"],
+            seed=pendiente["semilla"]
+        )
+    except Exception:
+        # El error ya se publicó en el tópico de progreso; la vista previa queda
+        return
+    
+    def reemplazar():
+        indice_similitud.vincular(pendiente["vista_previa"], resultado["nombre_archivo"])
+        with suppress(OSError):
+            os.remove(pendiente["ruta_local"])
+    
+    await asyncio.to_thread(reemplazar)
+
+
+def _reanudar(pendiente: dict):
+    """Vuelve a lanzar en segundo plano un trabajo guardado al apagar un worker"""
+    if pendiente.get("tipo") == "vista_previa":
+        en_segundo_plano(_completar_vista_previa(pendiente), reanudable=pendiente)
+
+
+@app.post("/api/nivel2/variaciones", tags=["Nivel 2 - Crear Imagen"],
+          responses={200: {"model": VariationResult, "content": {"application/x-ndjson": {}}}})
+async def crear_variaciones(request: VariationRequest):
+    """
+    Nivel 2: Genera N variaciones de un prompt con semillas deterministas
+    
+    - **prompt**: Descripción de la imagen
+    - **size**: Tamaño de las imágenes (WxH)
+    - **n**: Número de variaciones (máximo `MAX_VARIACIONES`)
+    - **semilla_base**: Las semillas usadas son semilla_base, semilla_base + 1, ...
+    - **semillas**: (Opcional) Lista explícita de semillas
+    
+    Las variaciones se generan en paralelo (respetando la cola de generaciones) y
+    se devuelven como NDJSON, una línea por variación en cuanto termina. Pedir de
+    nuevo la misma semilla se sirve desde disco (`desde_cache: true`).
+    """
+    # El modelo ya limita n y semillas a MAX_VARIACIONES
+    semillas = request.semillas or list(range(request.semilla_base, request.semilla_base + request.n))
+    semillas = list(dict.fromkeys(semillas))
+    if not TAMANO_VALIDO.match(request.size or ""):
+        raise HTTPException(status_code=400, detail="size debe tener el formato WxH (ej: 1024x1024)")
+    
+    image_service = ImageService()
+    
+    async def generar(semilla: int):
+        await cola_generaciones.entrar()
+        try:
+            return await image_service.create_variation_async(request.prompt, request.size, semilla)
+        except Exception as e:
+            return {"semilla": semilla, "error": str(e)}
+        finally:
+            cola_generaciones.salir()
+    
+    async def resultados():
+        tareas = [asyncio.ensure_future(generar(semilla)) for semilla in semillas]
+        try:
+            for siguiente in asyncio.as_completed(tareas):
+                yield dumps(await siguiente) + b"\n"
+        finally:
+            # Si el cliente se desconecta, no seguir generando
+            for tarea in tareas:
+                tarea.cancel()
+    
+    return StreamingResponse(resultados(), media_type="application/x-ndjson")
+
+
 @app.get("/api/nivel2/imagen/{filename}", tags=["Nivel 2 - Crear Imagen"])
 async def obtener_imagen(filename: str):
     """
     Obtiene una imagen generada por nombre de archivo
+    
+    Una vista previa cuya imagen completa ya terminó devuelve la imagen completa.
     """
+    if filename.startswith("preview_"):
+        # final_de puede esperar al lock del índice (cargar lo toma): fuera del event loop
+        filename = await asyncio.to_thread(indice_similitud.final_de, filename) or filename
     filepath = os.path.join(settings.IMAGES_DIR, filename)
     if not os.path.exists(filepath):
         raise HTTPException(status_code=404, detail="Imagen no encontrada")
@@ -155,18 +444,56 @@ async def obtener_imagen(filename: str):
 # NIVEL 3: EDITAR IMAGEN CON PROMPT
 # ============================================
 
+async def _guardar_fuente(imagen: UploadFile):
+    """Valida y guarda un upload PNG en el almacén de fuentes"""
+    if not imagen.filename.lower().endswith('.png'):
+        raise HTTPException(
+            status_code=400,
+            detail="La imagen debe ser formato PNG con transparencia"
+        )
+    try:
+        return await almacen_fuentes.guardar_upload(imagen)
+    except UploadDemasiadoGrande as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+
+@app.post("/api/nivel3/fuentes", response_model=SourceUploadResponse, tags=["Nivel 3 - Editar Imagen"])
+async def subir_fuente(
+    imagen: UploadFile = File(..., description="Imagen PNG que se editará después")
+):
+    """
+    Sube una imagen fuente una sola vez y devuelve su `id_fuente`
+    
+    Las ediciones posteriores pueden enviar `id_fuente` en lugar de volver a subir
+    la imagen. Subir la misma imagen de nuevo devuelve el mismo id sin guardarla
+    otra vez (`reutilizada: true`).
+    """
+    id_fuente, reutilizada, tamano = await _guardar_fuente(imagen)
+    metadatos = await asyncio.to_thread(almacen_fuentes.metadatos, id_fuente)
+    return RespuestaJSON({
+        "id_fuente": id_fuente,
+        "tamano_bytes": tamano,
+        "reutilizada": reutilizada,
+        **metadatos
+    })
+
+
 @app.post("/api/nivel3/editar-imagen", response_model=ImageEditResponse, tags=["Nivel 3 - Editar Imagen"])
 async def editar_imagen(
-    imagen: UploadFile = File(..., description="Imagen a editar (opcional en versión gratuita)"),
+    imagen: Optional[UploadFile] = File(None, description="Imagen a editar (opcional si se envía id_fuente)"),
     prompt: str = Form(..., description="Instrucciones para generar/editar la imagen"),
-    size: str = Form("1024x1024", description="Tamaño de la imagen resultante")
+    size: str = Form("1024x1024", description="Tamaño de la imagen resultante"),
+    id_progreso: Optional[str] = Form(None, description="Id para seguir el progreso en /api/progreso/{id_progreso}"),
+    id_fuente: Optional[str] = Form(None, description="Id de una imagen subida antes en /api/nivel3/fuentes")
 ):
     """
     Nivel 3: Genera una imagen según instrucciones usando IA GRATUITA
     
     - **imagen**: Archivo de imagen (en esta versión gratuita, se genera nueva imagen basada en prompt)
+    - **id_fuente**: (Opcional) Id devuelto por `POST /api/nivel3/fuentes`, en lugar de `imagen`
     - **prompt**: Descripción detallada de lo que quieres generar
     - **size**: Tamaño de la imagen resultante (cualquier WxH, ej: 512x512, 1024x1024)
+    - **id_progreso**: (Opcional) Id para seguir el progreso en `GET /api/progreso/{id_progreso}`
     
     ✨ COMPLETAMENTE GRATIS - Usa Pollinations.ai (Stable Diffusion)
     
@@ -177,40 +504,36 @@ async def editar_imagen(
     - URL de la imagen generada
     - Nombre del archivo guardado localmente
     """
+    id_progreso = _validar_id_progreso(id_progreso)
     try:
-        # Validar que sea PNG
-        if not imagen.filename.lower().endswith('.png'):
-            raise HTTPException(
-                status_code=400,
-                detail="La imagen debe ser formato PNG con transparencia"
-            )
-        
-        # Guardar imagen temporal
-        temp_filename = f"temp_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-        temp_filepath = os.path.join(settings.IMAGES_DIR, temp_filename)
-        
-        with open(temp_filepath, "wb") as buffer:
-            content = await imagen.read()
-            buffer.write(content)
+        if id_fuente is not None:
+            if not almacen_fuentes.existe(id_fuente):
+                raise HTTPException(status_code=404, detail="Imagen fuente no encontrada")
+            almacen_fuentes.tocar(id_fuente)
+        elif imagen is not None:
+            # Se guarda una sola vez por contenido: re-subir la misma imagen no la reescribe
+            id_fuente, _, _ = await _guardar_fuente(imagen)
+        else:
+            raise HTTPException(status_code=400, detail="Envía una imagen o un id_fuente")
         
         # Editar imagen
         image_service = ImageService()
-        resultado = image_service.edit_image(
-            image_path=temp_filepath,
+        resultado = await ejecutar_con_progreso(
+            id_progreso,
+            image_service.edit_image,
+            image_path=almacen_fuentes.ruta(id_fuente),
             prompt=prompt,
             size=size
         )
         
-        # Eliminar archivo temporal
-        if os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-        
-        return ImageEditResponse(
-            mensaje="Imagen editada exitosamente",
-            prompt=prompt,
-            url_imagen=resultado["url_imagen"],
-            nombre_archivo=resultado["nombre_archivo"]
-        )
+        return RespuestaJSON({
+            "mensaje": "Imagen editada exitosamente",
+            "prompt": prompt,
+            "url_imagen": resultado["url_imagen"],
+            "nombre_archivo": resultado["nombre_archivo"],
+            "id_progreso": id_progreso,
+            "id_fuente": id_fuente
+        })
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     except HTTPException:
@@ -230,6 +553,41 @@ async def obtener_imagen_editada(filename: str):
     return FileResponse(filepath)
 
 
+# ============================================
+# PROGRESO DE GENERACIONES (SERVER-SENT EVENTS)
+# ============================================
+
+@app.get("/api/progreso/{id_progreso}", tags=["Utilidades"])
+async def progreso_generacion(id_progreso: str):
+    """
+    Stream SSE con el progreso de una generación de los niveles 2 y 3
+    
+    Se puede abrir antes de enviar la petición de generación (con el mismo
+    `id_progreso`). Eventos:
+    - **en_cola**: posición en la cola de generaciones
+    - **solicitando**: se inició la petición a Pollinations.ai
+    - **descargando**: bytes recibidos y esperados (`total` puede ser null)
+    - **completado**: nombre del archivo final
+    - **error**: detalle del error
+    
+    El progreso vive en memoria del worker que atiende la generación.
+    """
+    _validar_id_progreso(id_progreso)
+    
+    async def eventos():
+        async for evento in broker.suscribir(id_progreso, settings.PROGRESO_KEEPALIVE):
+            if evento is None:
+                yield b": keepalive\n\n"
+            else:
+                yield b"event: " + evento["estado"].encode() + b"\ndata: " + dumps(evento) + b"\n\n"
+    
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 # ============================================
 # ENDPOINT ADICIONAL: LISTAR IMÁGENES
 # ============================================
@@ -251,13 +609,105 @@ async def listar_imagenes():
     }
 
 
-# Importar datetime para el nivel 3
-from datetime import datetime
+@app.get("/api/metricas", tags=["Utilidades"])
+async def obtener_metricas():
+    """
+    Métricas del worker: tiempo hasta el primer píxel de crear-imagen
+    (con y sin vista previa)
+    """
+    return {
+        "tiempo_primer_pixel": {modo: metrica.resumen() for modo, metrica in tiempo_primer_pixel.items()}
+    }
+
+
+@app.get("/api/imagenes/similares/{filename}", tags=["Utilidades"])
+async def imagenes_similares(filename: str, k: int = 10, max_distancia: int = 10):
+    """
+    Busca las imágenes más parecidas a una imagen ya generada
+    
+    - **filename**: Imagen de referencia
+    - **k**: Número máximo de resultados
+    - **max_distancia**: Distancia de Hamming máxima entre hashes (0-64, 0 = idénticas)
+    
+    Usa un hash perceptual (dHash de 64 bits) por imagen; sirve para encontrar
+    casi-duplicados.
+    """
+    if not indice_similitud.disponible:
+        raise HTTPException(status_code=503, detail="La búsqueda de similares requiere numpy y Pillow")
+    if not 1 <= k <= 100 or not 0 <= max_distancia <= HASH_BITS:
+        raise HTTPException(status_code=400, detail=f"k debe estar entre 1 y 100 y max_distancia entre 0 y {HASH_BITS}")
+    
+    valor = await asyncio.to_thread(indice_similitud.hash_de, filename)
+    if valor is None:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada en el índice")
+    
+    similares = await asyncio.to_thread(indice_similitud.buscar, valor, k, max_distancia, filename)
+    return {
+        "imagen": filename,
+        "hash": f"{valor:016x}",
+        "total": len(similares),
+        "similares": similares
+    }
+
+
+@app.post("/api/imagenes/exportar", tags=["Utilidades"],
+          responses={200: {"content": {"application/zip": {}}}})
+async def exportar_imagenes(filtro: ExportRequest):
+    """
+    Descarga en un ZIP las imágenes que cumplen el filtro
+    
+    - **tipo**: Prefijo del archivo (generated, edited, variation)
+    - **desde** / **hasta**: Rango de fechas de creación
+    - **archivos**: Lista explícita de nombres
+    
+    El ZIP se genera al vuelo mientras se descarga, con memoria constante sin
+    importar cuántas imágenes incluya. Las imágenes PNG/JPEG/WebP se guardan sin
+    volver a comprimir.
+    """
+    if filtro.archivos and any(os.path.basename(nombre) != nombre for nombre in filtro.archivos):
+        raise HTTPException(status_code=400, detail="Los nombres de archivo no pueden incluir rutas")
+    
+    entradas = seleccionar_imagenes(filtro.tipo, filtro.desde, filtro.hasta, filtro.archivos)
+    nombre_zip = f"imagenes_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(
+        generar_zip(entradas),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_zip}"'}
+    )
+
+
+# ============================================
+# ESQUEMA OPENAPI PRECALCULADO
+# ============================================
+
+def _servir_openapi_precalculado():
+    """
+    Reemplaza la ruta del esquema OpenAPI por una que lo serializa una sola vez
+    (FastAPI cachea el dict pero lo vuelve a convertir a JSON en cada petición)
+    """
+    cuerpo = None
+    
+    async def openapi(request: Request):
+        nonlocal cuerpo
+        if cuerpo is None:
+            cuerpo = RespuestaJSON(app.openapi()).body
+        return RespuestaJSON(cuerpo)
+    
+    app.router.routes[:] = [
+        ruta for ruta in app.router.routes
+        if getattr(ruta, "path", None) != app.openapi_url
+    ]
+    app.add_route(app.openapi_url, openapi, include_in_schema=False)
+
+
+_servir_openapi_precalculado()
 
 
 if __name__ == "__main__":
     import uvicorn
     print(f"Iniciando API Multi Nivel en http://{settings.HOST}:{settings.PORT}")
     print(f"Documentacion disponible en http://{settings.HOST}:{settings.PORT}/docs")
-    uvicorn.run(app, host=settings.HOST, port=settings.PORT)
+    # uvicorn espera a las peticiones en curso al cerrarse: acotarlo al plazo de apagado
+    uvicorn.run(app, host=settings.HOST, port=settings.PORT,
+                timeout_graceful_shutdown=int(settings.APAGADO_PLAZO))
 
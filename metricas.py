@@ -0,0 +1,42 @@
+"""
+Métricas de latencia en memoria del proceso
+
+Cada métrica guarda las últimas N muestras (ventana deslizante) y calcula los
+percentiles al consultarla, así registrar una muestra es O(1).
+"""
+from collections import deque
+
+
+class MetricaLatencia:
+    """Ventana de las últimas `max_muestras` latencias (en segundos)"""
+
+    def __init__(self, max_muestras: int = 1024):
+        self._muestras = deque(maxlen=max_muestras)
+        self.total = 0
+
+    def registrar(self, segundos: float):
+        self._muestras.append(segundos)
+        self.total += 1
+
+    def resumen(self) -> dict:
+        muestras = sorted(self._muestras)
+        if not muestras:
+            return {"total": self.total, "muestras": 0}
+
+        def percentil(p: float) -> float:
+            return round(muestras[min(len(muestras) - 1, int(p * len(muestras)))] * 1000, 2)
+
+        return {
+            "total": self.total,
+            "muestras": len(muestras),
+            "p50_ms": percentil(0.5),
+            "p95_ms": percentil(0.95),
+            "max_ms": round(muestras[-1] * 1000, 2),
+        }
+
+
+# Tiempo desde que llega la petición hasta que hay una imagen (vista previa o completa)
+tiempo_primer_pixel = {
+    "vista_previa": MetricaLatencia(),
+    "completa": MetricaLatencia(),
+}
@@ -1,8 +1,11 @@
 """
 Modelos de datos para la API
 """
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, conint
+from datetime import datetime
+from typing import List, Optional
+
+from config import settings
 
 # Nivel 1: Clima y Hora
 class WeatherRequest(BaseModel):
@@ -27,6 +30,9 @@ class ImageCreateRequest(BaseModel):
                        example="Un gato astronauta en el espacio")
     size: Optional[str] = Field("1024x1024", description="Tamaño de la imagen (ej: 512x512, 1024x1024, 1024x1792)")
     quality: Optional[str] = Field("standard", description="Calidad de la imagen (standard, hd)")
+    id_progreso: Optional[str] = Field(None, description="Id para seguir el progreso en /api/progreso/{id_progreso} (se genera uno si no se envía)")
+    vista_previa: bool = Field(False, description="Responder primero con una vista previa pequeña y generar la imagen completa en segundo plano")
+    semilla: Optional[int] = Field(None, ge=0, description="Semilla de la generación (con vista_previa se elige una si no se envía)")
 
 class ImageCreateResponse(BaseModel):
     """Response con la imagen generada"""
@@ -34,6 +40,27 @@ class ImageCreateResponse(BaseModel):
     prompt: str
     url_imagen: str
     nombre_archivo: str
+    id_progreso: Optional[str] = None
+    vista_previa: bool = False
+    semilla: Optional[int] = None
+
+class VariationRequest(BaseModel):
+    """Request para generar varias variaciones de un prompt con semillas explícitas"""
+    prompt: str = Field(..., description="Descripción de la imagen a generar",
+                       example="Un gato astronauta en el espacio")
+    size: Optional[str] = Field("1024x1024", description="Tamaño de las imágenes (ej: 512x512, 1024x1024)")
+    n: int = Field(4, ge=1, le=settings.MAX_VARIACIONES, description="Número de variaciones a generar")
+    semilla_base: int = Field(0, ge=0, description="Semilla de la primera variación (las demás usan semilla_base + i)")
+    semillas: Optional[List[conint(ge=0)]] = Field(None, max_length=settings.MAX_VARIACIONES,
+                                                   description="Semillas explícitas (si se envían, se ignoran n y semilla_base)")
+
+class VariationResult(BaseModel):
+    """Una línea del stream de variaciones"""
+    semilla: int
+    url_imagen: Optional[str] = None
+    nombre_archivo: Optional[str] = None
+    desde_cache: Optional[bool] = None
+    error: Optional[str] = None
 
 # Nivel 3: Editar Imagen
 class ImageEditRequest(BaseModel):
@@ -48,6 +75,24 @@ class ImageEditResponse(BaseModel):
     prompt: str
     url_imagen: str
     nombre_archivo: str
+    id_progreso: Optional[str] = None
+    id_fuente: Optional[str] = None
+
+class SourceUploadResponse(BaseModel):
+    """Response al subir una imagen fuente para editarla después"""
+    id_fuente: str
+    tamano_bytes: int
+    reutilizada: bool
+    ancho: Optional[int] = None
+    alto: Optional[int] = None
+
+# Utilidades: exportar imágenes
+class ExportRequest(BaseModel):
+    """Filtro de imágenes a exportar en un ZIP"""
+    tipo: Optional[str] = Field(None, description="Prefijo del archivo: generated, edited, variation", example="generated")
+    desde: Optional[datetime] = Field(None, description="Fecha mínima de creación (ISO 8601)")
+    hasta: Optional[datetime] = Field(None, description="Fecha máxima de creación (ISO 8601)")
+    archivos: Optional[List[str]] = Field(None, description="Lista explícita de nombres de archivo")
 
 # Respuestas generales
 class ErrorResponse(BaseModel):
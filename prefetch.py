@@ -0,0 +1,142 @@
+"""
+Prefetch en segundo plano de las ciudades más consultadas
+
+Se lleva un contador decreciente (vida media configurable) por ciudad consultada
+en /api/nivel1/clima, con un máximo de ciudades en memoria. Una tarea de fondo
+revisa periódicamente las N ciudades con mayor puntaje y refresca en la caché
+las que están por expirar, dentro de un presupuesto de peticiones por minuto a
+OpenWeather compartido por todos los workers del host.
+"""
+import asyncio
+import math
+import os
+import time
+from typing import List, Optional
+
+from config import settings
+from cache import weather_cache
+from rate_limit import RateLimiter
+from services import WeatherService
+
+
+class FrecuenciaDecayente:
+    """
+    Puntaje de acceso por clave que decae exponencialmente con el tiempo
+
+    El decaimiento se aplica de forma perezosa al registrar o consultar. Si se
+    supera `max_claves`, se descartan las claves con menor puntaje actual; además
+    `top` borra las claves cuyo puntaje ya decayó por debajo de PUNTAJE_OLVIDO.
+
+    Con accesos a una tasa constante r (por segundo) el puntaje tiende a r / lambda,
+    así que los accesos por segundo esperados se estiman como puntaje * lambda.
+    """
+
+    PUNTAJE_OLVIDO = 0.01
+
+    def __init__(self, vida_media: float, max_claves: int):
+        self.lambda_ = math.log(2) / vida_media
+        self.max_claves = max_claves
+        # clave -> [puntaje, último registro, nombre original de la ciudad]
+        self._datos = {}
+
+    def _puntaje(self, item, ahora: float) -> float:
+        return item[0] * math.exp(-self.lambda_ * (ahora - item[1]))
+
+    def registrar(self, clave: str, nombre: str, ahora: Optional[float] = None):
+        ahora = time.time() if ahora is None else ahora
+        item = self._datos.get(clave)
+        if item is None:
+            if len(self._datos) >= self.max_claves:
+                self._recortar(ahora)
+            self._datos[clave] = [1.0, ahora, nombre]
+        else:
+            item[0] = self._puntaje(item, ahora) + 1.0
+            item[1] = ahora
+            item[2] = nombre
+
+    def _recortar(self, ahora: float):
+        """Conserva el 75% de las claves con mayor puntaje"""
+        conservar = int(self.max_claves * 0.75)
+        ordenadas = sorted(self._datos.items(), key=lambda kv: self._puntaje(kv[1], ahora), reverse=True)
+        self._datos = dict(ordenadas[:conservar])
+
+    def puntaje_para(self, aciertos: float, ventana: float) -> float:
+        """Puntaje de una clave que se espera consultar `aciertos` veces en `ventana` segundos"""
+        # aciertos = tasa * ventana = puntaje * lambda * ventana
+        return aciertos / (self.lambda_ * ventana)
+
+    def top(self, n: int, ahora: Optional[float] = None, minimo: float = 0.0) -> List[tuple]:
+        """Las `n` claves con mayor puntaje (al menos `minimo`) como (clave, nombre, puntaje)"""
+        ahora = time.time() if ahora is None else ahora
+        puntajes = []
+        olvidadas = []
+        for clave, item in self._datos.items():
+            puntaje = self._puntaje(item, ahora)
+            if puntaje < self.PUNTAJE_OLVIDO:
+                olvidadas.append(clave)
+            elif puntaje >= minimo:
+                puntajes.append((clave, item[2], puntaje))
+        for clave in olvidadas:
+            del self._datos[clave]
+        puntajes.sort(key=lambda p: p[2], reverse=True)
+        return puntajes[:n]
+
+    def __len__(self):
+        return len(self._datos)
+
+
+class PrefetchClima:
+    """Tarea de fondo que mantiene caliente la caché de las ciudades más consultadas"""
+
+    def __init__(self, frecuencias: FrecuenciaDecayente, presupuesto: RateLimiter):
+        self.frecuencias = frecuencias
+        self.presupuesto = presupuesto
+        self.refrescos = 0
+        self.sin_presupuesto = 0
+        self.errores = 0
+
+    async def revisar(self):
+        """
+        Refresca las ciudades del top que expiran dentro del margen configurado
+
+        Solo se consideran las ciudades que, a su tasa actual, se esperan consultar
+        al menos PREFETCH_MIN_ACIERTOS veces durante el TTL del clima: refrescar una
+        ciudad fría gasta presupuesto de OpenWeather sin evitar ningún miss.
+        """
+        ahora = time.time()
+        minimo = self.frecuencias.puntaje_para(settings.PREFETCH_MIN_ACIERTOS, settings.CACHE_TTL_CLIMA)
+        for clave, nombre, _ in self.frecuencias.top(settings.PREFETCH_TOP_N, ahora, minimo):
+            expira = weather_cache.expira(clave)
+            if expira is not None and expira - ahora > settings.PREFETCH_MARGEN:
+                continue
+            resultado = self.presupuesto.consumir("prefetch", "global")
+            if resultado is not None and not resultado.permitido:
+                self.sin_presupuesto += 1
+                return
+            try:
+                await WeatherService.refrescar(nombre)
+                self.refrescos += 1
+            except Exception:
+                self.errores += 1
+
+    async def ejecutar(self):
+        while True:
+            await asyncio.sleep(settings.PREFETCH_INTERVALO)
+            try:
+                await self.revisar()
+            except Exception:
+                # La tarea de fondo no debe morir por un error puntual
+                self.errores += 1
+
+
+frecuencia_ciudades = FrecuenciaDecayente(
+    vida_media=settings.PREFETCH_VIDA_MEDIA,
+    max_claves=settings.PREFETCH_MAX_CIUDADES,
+)
+prefetch_clima = PrefetchClima(
+    frecuencia_ciudades,
+    RateLimiter(
+        db_path=os.path.join(settings.STATE_DIR, "rate_limit.db"),
+        limites={"prefetch": (settings.PREFETCH_PRESUPUESTO, 60.0)},
+    ),
+)
@@ -0,0 +1,207 @@
+"""
+Progreso de generaciones de imágenes (pub/sub en memoria del proceso)
+
+Cada generación tiene un tópico con la lista de eventos publicados. Publicar un
+evento lo agrega a la lista y despierta a todos los suscriptores con un único
+asyncio.Event, así que el costo de publicar no depende de cuántos clientes
+estén escuchando y ningún suscriptor hace polling.
+"""
+import asyncio
+import itertools
+import re
+import uuid
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+from fastapi.concurrency import run_in_threadpool
+
+from config import settings
+
+ID_VALIDO = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Estados que cierran un tópico
+ESTADOS_FINALES = ("completado", "error")
+
+
+def nuevo_id() -> str:
+    return uuid.uuid4().hex
+
+
+class Topico:
+    """Eventos de una generación y señal de cambio para sus suscriptores"""
+
+    __slots__ = ("eventos", "cambio", "terminado", "suscriptores")
+
+    def __init__(self):
+        self.eventos = []
+        self.cambio = asyncio.Event()
+        self.terminado = False
+        self.suscriptores = 0
+
+
+class ProgressBroker:
+    """Registro de tópicos de progreso por id de generación"""
+
+    def __init__(self, retencion: float):
+        self.retencion = retencion
+        self._topicos = {}
+
+    def _topico(self, id_progreso: str) -> Topico:
+        topico = self._topicos.get(id_progreso)
+        if topico is None:
+            topico = self._topicos[id_progreso] = Topico()
+        return topico
+
+    def publicar(self, id_progreso: str, evento: dict):
+        """Publica un evento (debe llamarse desde el event loop)"""
+        topico = self._topico(id_progreso)
+        if topico.terminado:
+            return
+        topico.eventos.append(evento)
+        if evento.get("estado") in ESTADOS_FINALES:
+            topico.terminado = True
+            asyncio.get_running_loop().call_later(self.retencion, self._descartar, id_progreso)
+        # Despertar a todos los suscriptores y preparar la señal siguiente
+        cambio, topico.cambio = topico.cambio, asyncio.Event()
+        cambio.set()
+
+    def publicador(self, id_progreso: str) -> Callable[[dict], None]:
+        """
+        Devuelve una función para publicar eventos desde cualquier hilo
+        (la generación corre en el threadpool, fuera del event loop)
+        """
+        loop = asyncio.get_running_loop()
+        self._topico(id_progreso)
+
+        def publicar(evento: dict):
+            loop.call_soon_threadsafe(self.publicar, id_progreso, evento)
+
+        return publicar
+
+    async def suscribir(self, id_progreso: str, espera_maxima: float) -> AsyncIterator[Optional[dict]]:
+        """
+        Itera los eventos de una generación desde el principio hasta que termine
+
+        Entrega None cada `espera_maxima` segundos sin eventos nuevos, para que
+        quien consume pueda mandar un keepalive.
+        """
+        topico = self._topico(id_progreso)
+        topico.suscriptores += 1
+        indice = 0
+        try:
+            while True:
+                while indice < len(topico.eventos):
+                    yield topico.eventos[indice]
+                    indice += 1
+                if topico.terminado:
+                    return
+                try:
+                    await asyncio.wait_for(topico.cambio.wait(), espera_maxima)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            topico.suscriptores -= 1
+            # Un tópico que solo abrió un suscriptor y nunca recibió eventos se descarta
+            if not topico.suscriptores and not topico.eventos:
+                self._topicos.pop(id_progreso, None)
+
+    def _descartar(self, id_progreso: str):
+        topico = self._topicos.get(id_progreso)
+        if topico is not None and topico.terminado:
+            del self._topicos[id_progreso]
+
+
+class ColaGeneraciones:
+    """
+    Limita las generaciones simultáneas contra Pollinations e informa a cada
+    generación en espera de su posición en la cola
+
+    Las generaciones prioritarias (vistas previas, pequeñas y con un cliente
+    esperando) ocupan un cupo como cualquier otra, pero esperan en una fila
+    aparte que se atiende antes que la normal.
+    """
+
+    def __init__(self, max_concurrentes: int):
+        self.max_concurrentes = max_concurrentes
+        self.en_curso = 0
+        self._prioritarias = deque()
+        self._esperando = deque()
+
+    def _avisar_posiciones(self):
+        esperando = itertools.chain(self._prioritarias, self._esperando)
+        for posicion, (_, publicar) in enumerate(esperando, start=1):
+            if publicar is not None:
+                publicar({"estado": "en_cola", "posicion": posicion})
+
+    async def entrar(self, publicar: Optional[Callable[[dict], None]] = None,
+                     prioritaria: bool = False):
+        if self.en_curso < self.max_concurrentes and not self.en_espera:
+            self.en_curso += 1
+            return
+        fila = self._prioritarias if prioritaria else self._esperando
+        turno = asyncio.get_running_loop().create_future()
+        fila.append((turno, publicar))
+        if publicar is not None:
+            posicion = len(self._prioritarias) + (0 if prioritaria else len(self._esperando))
+            publicar({"estado": "en_cola", "posicion": posicion})
+        if prioritaria:
+            # Las que estaban en la fila normal bajaron un puesto
+            self._avisar_posiciones()
+        try:
+            await turno
+        except asyncio.CancelledError:
+            if turno.done() and not turno.cancelled():
+                # Ya se le había cedido el cupo: devolverlo
+                self.salir()
+            elif (turno, publicar) in fila:
+                fila.remove((turno, publicar))
+                self._avisar_posiciones()
+            raise
+
+    def salir(self):
+        for fila in (self._prioritarias, self._esperando):
+            while fila:
+                turno, _ = fila.popleft()
+                if not turno.done():
+                    # El cupo pasa directamente a la siguiente generación
+                    turno.set_result(None)
+                    self._avisar_posiciones()
+                    return
+        self.en_curso -= 1
+
+    @property
+    def en_espera(self) -> int:
+        return len(self._prioritarias) + len(self._esperando)
+
+
+async def ejecutar_con_progreso(id_progreso: str, funcion: Callable, **kwargs):
+    """
+    Ejecuta una generación bloqueante en el threadpool respetando la cola de
+    generaciones y publicando su progreso en el tópico `id_progreso`
+    """
+    publicar = broker.publicador(id_progreso)
+    await cola_generaciones.entrar(publicar)
+    try:
+        return await run_in_threadpool(funcion, progreso=publicar, **kwargs)
+    except Exception as e:
+        publicar({"estado": "error", "detalle": str(e)})
+        raise
+    finally:
+        cola_generaciones.salir()
+
+
+broker = ProgressBroker(retencion=settings.PROGRESO_RETENCION)
+cola_generaciones = ColaGeneraciones(settings.MAX_GENERACIONES_CONCURRENTES)
+
+
+# Trabajo que sigue después de responder (ej: la imagen completa tras la vista previa).
+# Se guardan las referencias para que las tareas no se recolecten a mitad de camino,
+# junto con los datos para reanudarlas si el worker se apaga antes de que terminen.
+tareas_en_segundo_plano = {}
+
+
+def en_segundo_plano(coro, reanudable: Optional[dict] = None) -> asyncio.Task:
+    tarea = asyncio.create_task(coro)
+    tareas_en_segundo_plano[tarea] = reanudable
+    tarea.add_done_callback(lambda t: tareas_en_segundo_plano.pop(t, None))
+    return tarea
@@ -0,0 +1,206 @@
+"""
+Limitación de tasa (token bucket) por cliente y grupo de rutas
+
+El estado de los buckets vive en una base SQLite local (modo WAL), de modo que
+todos los workers de uvicorn en el mismo host comparten los mismos límites
+sin depender de un servicio externo.
+"""
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from config import settings
+
+
+# Grupos de rutas con límites independientes
+GRUPOS_RUTAS = (
+    ("/api/nivel1/", "clima"),
+    ("/api/nivel2/crear-imagen", "crear"),
+    ("/api/nivel2/variaciones", "crear"),
+    ("/api/nivel3/editar-imagen", "editar"),
+    ("/api/nivel3/fuentes", "lectura"),
+    ("/api/imagenes/exportar", "lectura"),
+)
+
+
+def grupo_de_ruta(method: str, path: str) -> Optional[str]:
+    """
+    Devuelve el grupo de límite al que pertenece una ruta, o None si no se limita
+    """
+    for prefijo, grupo in GRUPOS_RUTAS:
+        if path.startswith(prefijo):
+            return grupo
+    if method == "GET" and path.startswith("/api/"):
+        return "lectura"
+    return None
+
+
+def identificar_cliente(api_key: Optional[str], ip: Optional[str]) -> str:
+    """
+    Identifica al cliente por su API key (hasheada) si es una de API_KEYS o, si
+    no, por su IP. Una key desconocida no cuenta: de lo contrario, rotar keys
+    inventadas daría un bucket lleno en cada petición.
+    """
+    if api_key and api_key in settings.API_KEYS:
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:32]
+    return f"ip:{ip or 'desconocida'}"
+
+
+class RateLimitResult:
+    """Resultado de consumir un token de un bucket"""
+
+    __slots__ = ("permitido", "limite", "restantes", "reset", "retry_after")
+
+    def __init__(self, permitido: bool, limite: int, restantes: int, reset: int, retry_after: int):
+        self.permitido = permitido
+        self.limite = limite
+        self.restantes = restantes
+        self.reset = reset
+        self.retry_after = retry_after
+
+    def headers(self) -> dict:
+        """Cabeceras RateLimit-* (y Retry-After si se rechazó la petición)"""
+        headers = {
+            "RateLimit-Limit": str(self.limite),
+            "RateLimit-Remaining": str(self.restantes),
+            "RateLimit-Reset": str(self.reset),
+        }
+        if not self.permitido:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+class RateLimiter:
+    """
+    Token bucket compartido entre procesos a través de SQLite
+
+    Cada bucket se identifica por (grupo, cliente) y se recarga de forma continua
+    a razón de `capacidad / periodo` tokens por segundo. Como camino rápido,
+    cada proceso recuerda los buckets vacíos hasta que vuelvan a tener un token
+    y rechaza esas peticiones sin tocar la base de datos.
+
+    `consumir` corre en el event loop: si otro worker tiene tomada la base más de
+    `espera_bloqueo` segundos, la petición pasa sin contar (fail-open) en lugar de
+    frenar el loop. Cada INTERVALO_PODA segundos se borran los buckets que ya se
+    recargaron por completo (equivalen a no tener fila).
+    """
+
+    INTERVALO_PODA = 60.0
+
+    def __init__(self, db_path: str, limites: dict, espera_bloqueo: float = 0.05):
+        self.db_path = db_path
+        self.limites = limites
+        self.espera_bloqueo = espera_bloqueo
+        self._local = threading.local()
+        self._bloqueados = {}
+        self._ultima_poda = time.time()
+        self.sin_bloqueo = 0
+
+    def _conexion(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directorio = os.path.dirname(self.db_path)
+            if directorio:
+                os.makedirs(directorio, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=self.espera_bloqueo, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                " clave TEXT PRIMARY KEY, tokens REAL NOT NULL, actualizado REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def consumir(self, grupo: str, cliente: str) -> Optional[RateLimitResult]:
+        """
+        Intenta consumir un token del bucket; None si el grupo no tiene límite
+        """
+        limite = self.limites.get(grupo)
+        if not limite:
+            return None
+        capacidad, periodo = limite
+        tasa = capacidad / periodo
+        clave = f"{grupo}|{cliente}"
+        ahora = time.time()
+
+        # Camino rápido: el bucket estaba vacío y aún no se ha recargado
+        desbloqueo = self._bloqueados.get(clave)
+        if desbloqueo is not None:
+            if ahora < desbloqueo:
+                espera = desbloqueo - ahora
+                return RateLimitResult(False, capacidad, 0, math.ceil(capacidad / tasa), math.ceil(espera))
+            del self._bloqueados[clave]
+
+        conn = self._conexion()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.OperationalError:
+            # Base tomada por otro worker: dejar pasar antes que bloquear el loop
+            self.sin_bloqueo += 1
+            return None
+        try:
+            fila = conn.execute(
+                "SELECT tokens, actualizado FROM buckets WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                tokens = float(capacidad)
+            else:
+                tokens = min(capacidad, fila[0] + max(0.0, ahora - fila[1]) * tasa)
+
+            permitido = tokens >= 1
+            if permitido:
+                tokens -= 1
+            conn.execute(
+                "INSERT INTO buckets (clave, tokens, actualizado) VALUES (?, ?, ?) "
+                "ON CONFLICT(clave) DO UPDATE SET tokens = excluded.tokens, actualizado = excluded.actualizado",
+                (clave, tokens, ahora),
+            )
+            conn.execute("COMMIT")
+        except sqlite3.OperationalError:
+            conn.execute("ROLLBACK")
+            self.sin_bloqueo += 1
+            return None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if ahora - self._ultima_poda >= self.INTERVALO_PODA:
+            self._ultima_poda = ahora
+            self._podar(conn, ahora)
+
+        reset = math.ceil((capacidad - tokens) / tasa)
+        if permitido:
+            return RateLimitResult(True, capacidad, int(tokens), reset, 0)
+
+        espera = (1 - tokens) / tasa
+        if len(self._bloqueados) >= 10000:
+            self._bloqueados = {k: v for k, v in self._bloqueados.items() if v > ahora}
+        self._bloqueados[clave] = ahora + espera
+        return RateLimitResult(False, capacidad, 0, reset, math.ceil(espera))
+
+    def _podar(self, conn: sqlite3.Connection, ahora: float):
+        """Borra los buckets llenos: sin esto la tabla crece con cada IP nueva"""
+        try:
+            for grupo, limite in self.limites.items():
+                if not limite:
+                    continue
+                capacidad, periodo = limite
+                conn.execute(
+                    "DELETE FROM buckets WHERE clave LIKE ? AND actualizado + (? - tokens) * ? <= ?",
+                    (f"{grupo}|%", capacidad, periodo / capacidad, ahora),
+                )
+        except sqlite3.OperationalError:
+            # Se reintenta en la próxima poda
+            pass
+
+
+rate_limiter = RateLimiter(
+    db_path=os.path.join(settings.STATE_DIR, "rate_limit.db"),
+    limites=settings.RATE_LIMITS,
+    espera_bloqueo=settings.RATE_LIMIT_ESPERA_BLOQUEO,
+)
@@ -0,0 +1,263 @@
+"""
+Registro de acceso estructurado (JSON por línea) sin bloquear el event loop
+
+Cada petición produce un dict con ruta, status, latencia, latencia de los
+servicios externos, acierto de caché, bytes enviados y cliente. El middleware
+solo lo encola en una cola acotada; un hilo de fondo lo serializa y lo escribe
+en lotes, rotando el archivo por tamaño.
+
+Todos los workers escriben el mismo archivo: cada lote se escribe (y el archivo
+se rota, si hace falta) bajo un lock exclusivo de fcntl, así que el disco usado
+queda acotado a (1 + ACCESS_LOG_RESPALDOS) archivos sin importar cuántos workers
+hayan existido. Sin fcntl (Windows) se escribe sin lock.
+
+Si la cola se llena por encima de la mitad se empieza a muestrear: de las
+respuestas exitosas solo se guarda 1 de cada ACCESS_LOG_MUESTREO (el registro
+lleva el campo "muestreo" para poder re-ponderar). Los errores se encolan
+siempre que quepan. Si la cola está llena el registro se descarta y se cuenta.
+
+Los servicios agregan datos al registro de la petición en curso con
+`anotar_cache`, `medir_upstream` y `anotar` (contextvar, funciona también en el
+threadpool).
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import settings
+from rate_limit import identificar_cliente
+from respuestas import dumps
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+_registro_actual = contextvars.ContextVar("registro_acceso", default=None)
+
+
+def anotar_cache(acierto: bool):
+    """Marca la petición en curso como hit o miss de caché"""
+    registro = _registro_actual.get()
+    if registro is not None:
+        registro["cache"] = "hit" if acierto else "miss"
+
+
+def anotar(**campos):
+    """Agrega campos extra al registro de la petición en curso"""
+    registro = _registro_actual.get()
+    if registro is not None:
+        registro.setdefault("extra", {}).update(campos)
+
+
+@contextmanager
+def medir_upstream():
+    """Suma al registro de la petición en curso el tiempo del bloque (llamada externa)"""
+    registro = _registro_actual.get()
+    if registro is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro["upstream_ms"] = round(
+            registro.get("upstream_ms", 0.0) + (time.perf_counter() - inicio) * 1000, 2
+        )
+
+
+class RegistroAcceso:
+    """Cola acotada de registros y el hilo que los escribe con rotación por tamaño"""
+
+    def __init__(self, ruta: str, max_cola: int, lote: int, max_bytes: int,
+                 respaldos: int, muestreo: int):
+        self.ruta = ruta
+        self.lote = lote
+        self.max_bytes = max_bytes
+        self.respaldos = respaldos
+        self.muestreo = max(1, muestreo)
+        self._cola = queue.Queue(maxsize=max_cola)
+        self._umbral_muestreo = max_cola // 2
+        self._contador_muestreo = 0
+        self._detener = threading.Event()
+        self._hilo = None
+        self.escritos = 0
+        self.descartados = 0
+        self.omitidos_por_muestreo = 0
+        self.errores_escritura = 0
+        self.rotaciones = 0
+
+    # ---- Lado de las peticiones (event loop) ----
+
+    def registrar(self, registro: dict):
+        """Encola un registro sin bloquear nunca"""
+        if self._cola.qsize() >= self._umbral_muestreo and registro.get("status", 0) < 400:
+            self._contador_muestreo += 1
+            if self._contador_muestreo % self.muestreo:
+                self.omitidos_por_muestreo += 1
+                return
+            registro["muestreo"] = self.muestreo
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            self.descartados += 1
+
+    # ---- Hilo escritor ----
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._escribir_siempre, name="registro-acceso", daemon=True)
+        self._hilo.start()
+
+    def detener(self, espera: float = 5.0):
+        """Escribe lo que quede en la cola (hasta `espera` segundos) y termina el hilo"""
+        if self._hilo is None:
+            return
+        self._detener.set()
+        self._hilo.join(espera)
+        self._hilo = None
+
+    def _escribir_siempre(self):
+        while not (self._detener.is_set() and self._cola.empty()):
+            try:
+                lote = [self._cola.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(lote) < self.lote:
+                try:
+                    lote.append(self._cola.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._escribir(b"".join(dumps(registro) + b"\n" for registro in lote))
+                self.escritos += len(lote)
+            except Exception:
+                # Sin disco o sin permisos: se pierde el lote, no el hilo
+                self.errores_escritura += len(lote)
+
+    @contextmanager
+    def _lock_archivo(self):
+        """Lock exclusivo entre workers sobre `<ruta>.lock`"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.ruta + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _escribir(self, datos: bytes):
+        with self._lock_archivo():
+            try:
+                tamano = os.path.getsize(self.ruta)
+            except OSError:
+                tamano = 0
+            if tamano and tamano + len(datos) > self.max_bytes:
+                self._rotar()
+            with open(self.ruta, "ab") as archivo:
+                archivo.write(datos)
+
+    def _rotar(self):
+        """
+        access.log -> access.log.1 -> ... -> access.log.N (el más viejo se borra)
+        Se llama con el lock tomado: un solo worker rota a la vez.
+        """
+        if self.respaldos <= 0:
+            os.remove(self.ruta)
+        else:
+            for n in range(self.respaldos - 1, 0, -1):
+                origen = f"{self.ruta}.{n}"
+                if os.path.exists(origen):
+                    os.replace(origen, f"{self.ruta}.{n + 1}")
+            os.replace(self.ruta, f"{self.ruta}.1")
+        self.rotaciones += 1
+
+    def estado(self) -> dict:
+        return {
+            "en_cola": self._cola.qsize(),
+            "escritos": self.escritos,
+            "descartados": self.descartados,
+            "omitidos_por_muestreo": self.omitidos_por_muestreo,
+            "errores_escritura": self.errores_escritura,
+            "rotaciones": self.rotaciones,
+        }
+
+
+registro_acceso = RegistroAcceso(
+    ruta=settings.ACCESS_LOG_PATH,
+    max_cola=settings.ACCESS_LOG_MAX_COLA,
+    lote=settings.ACCESS_LOG_LOTE,
+    max_bytes=settings.ACCESS_LOG_MAX_BYTES,
+    respaldos=settings.ACCESS_LOG_RESPALDOS,
+    muestreo=settings.ACCESS_LOG_MUESTREO,
+)
+
+
+class AccessLogMiddleware:
+    """
+    Middleware ASGI que arma el registro de cada petición y lo encola
+
+    Va por fuera del resto de middlewares para registrar también los 429 del
+    rate limiting y los 503 del control de admisión. La latencia es hasta que
+    termina de enviarse la respuesta (incluidos los streams).
+    """
+
+    def __init__(self, app, registro: RegistroAcceso = registro_acceso):
+        self.app = app
+        self.registro = registro
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        datos = {"status": 500, "bytes": 0}
+        token = _registro_actual.set(datos)
+
+        async def send_registrado(mensaje):
+            if mensaje["type"] == "http.response.start":
+                datos["status"] = mensaje["status"]
+            elif mensaje["type"] == "http.response.body":
+                datos["bytes"] += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_registrado)
+        finally:
+            _registro_actual.reset(token)
+            self.registro.registrar(self._armar(scope, datos, inicio))
+
+    @staticmethod
+    def _armar(scope, datos: dict, inicio: float) -> dict:
+        api_key = None
+        for nombre, valor in scope.get("headers", ()):
+            if nombre == b"x-api-key":
+                api_key = valor.decode("latin-1")
+                break
+        cliente = scope.get("client")
+        registro = {
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "metodo": scope["method"],
+            "ruta": scope["path"],
+            "status": datos["status"],
+            "latencia_ms": round((time.perf_counter() - inicio) * 1000, 2),
+            "upstream_ms": datos.get("upstream_ms"),
+            "cache": datos.get("cache"),
+            "bytes": datos["bytes"],
+            "cliente": identificar_cliente(api_key, cliente[0] if cliente else None),
+        }
+        if "extra" in datos:
+            registro.update(datos["extra"])
+        return registro
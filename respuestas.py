@@ -0,0 +1,32 @@
+"""
+Clase de respuesta JSON rápida para la API
+
+Usa orjson si está instalado (con fallback a json de la librería estándar) y
+acepta bytes ya serializados, para que los payloads estáticos se serialicen
+una sola vez al arrancar.
+"""
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson es opcional
+    orjson = None
+
+
+def dumps(contenido: Any) -> bytes:
+    """Serializa a JSON compacto en UTF-8"""
+    if orjson is not None:
+        return orjson.dumps(contenido)
+    return json.dumps(contenido, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class RespuestaJSON(JSONResponse):
+    """JSONResponse que serializa con orjson y deja pasar bytes precalculados"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
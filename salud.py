@@ -0,0 +1,128 @@
+"""
+Liveness (/health) y readiness (/ready) respaldados por sondeos en segundo plano
+
+Una tarea de fondo sondea cada SALUD_INTERVALO segundos OpenWeather y
+Pollinations (basta con que respondan, no se gasta cuota: OpenWeather se consulta
+sin API key) y el espacio libre en IMAGES_DIR. Con cada resultado se arman de una
+vez los mensajes ASGI de la respuesta, así que atender un sondeo es devolver
+objetos ya construidos: sin routing, sin middlewares y sin serializar nada.
+
+Un servicio externo se marca caído recién después de SALUD_FALLOS_MAX sondeos
+fallidos seguidos, para no sacar al worker del balanceador por un error aislado.
+"""
+import asyncio
+import shutil
+import time
+from datetime import datetime, timezone
+
+from config import settings
+from apagado import apagado
+from respuestas import dumps
+from services import cliente_http
+
+URL_POLLINATIONS = "https://image.pollinations.ai/"
+
+
+def _mensajes(status: int, contenido: dict) -> tuple:
+    cuerpo = dumps(contenido)
+    inicio = {
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"cache-control", b"no-store"),
+        ],
+    }
+    return inicio, {"type": "http.response.body", "body": cuerpo}, {"type": "http.response.body", "body": b""}
+
+
+_VIVO = _mensajes(200, {"estado": "ok"})
+_VIVO_DRENANDO = _mensajes(200, {"estado": "drenando"})
+_DRENANDO = _mensajes(503, {"estado": "drenando"})
+
+
+class Salud:
+    """Resultado de los últimos sondeos y las respuestas de /ready ya armadas"""
+
+    def __init__(self):
+        self.fallos = {"openweather": 0, "pollinations": 0}
+        self.checks = {}
+        self.listo = False
+        self._ready = _mensajes(503, {"estado": "iniciando"})
+
+    async def _sondear_http(self, nombre: str, metodo: str, url: str) -> dict:
+        inicio = time.perf_counter()
+        try:
+            response = await cliente_http().request(metodo, url, timeout=settings.SALUD_TIMEOUT)
+            respondio = response.status_code < 500
+            detalle = response.status_code
+        except Exception as e:
+            respondio = False
+            detalle = type(e).__name__
+        self.fallos[nombre] = 0 if respondio else self.fallos[nombre] + 1
+        return {
+            "ok": self.fallos[nombre] < settings.SALUD_FALLOS_MAX,
+            "respondio": respondio,
+            "detalle": detalle,
+            "latencia_ms": round((time.perf_counter() - inicio) * 1000, 2),
+        }
+
+    @staticmethod
+    def _sondear_disco() -> dict:
+        try:
+            libre = shutil.disk_usage(settings.IMAGES_DIR).free
+        except OSError as e:
+            return {"ok": False, "detalle": type(e).__name__}
+        return {"ok": libre >= settings.SALUD_DISCO_MIN_MB * 1024 * 1024, "libre_mb": libre // (1024 * 1024)}
+
+    async def sondear(self):
+        openweather, pollinations, disco = await asyncio.gather(
+            self._sondear_http("openweather", "GET", settings.OPENWEATHER_BASE_URL),
+            self._sondear_http("pollinations", "HEAD", URL_POLLINATIONS),
+            asyncio.to_thread(self._sondear_disco),
+        )
+        self.checks = {"openweather": openweather, "pollinations": pollinations, "disco": disco}
+        self.listo = all(check["ok"] for check in self.checks.values())
+        self._ready = _mensajes(200 if self.listo else 503, {
+            "estado": "listo" if self.listo else "no_listo",
+            "checks": self.checks,
+            "actualizado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        })
+
+    async def ejecutar(self):
+        while True:
+            try:
+                await self.sondear()
+            except Exception:
+                # La tarea de fondo no debe morir por un error puntual
+                pass
+            await asyncio.sleep(settings.SALUD_INTERVALO)
+
+    def respuesta(self, path: str) -> tuple:
+        if path == "/health":
+            return _VIVO_DRENANDO if apagado.drenando else _VIVO
+        return _DRENANDO if apagado.drenando else self._ready
+
+
+salud = Salud()
+
+
+class SaludMiddleware:
+    """
+    Responde /health y /ready antes que cualquier otro middleware (el más
+    externo), con los mensajes ya armados por la última ronda de sondeos
+    """
+
+    def __init__(self, app, estado: Salud = salud):
+        self.app = app
+        self.estado = estado
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in ("/health", "/ready") \
+                or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        inicio, cuerpo, vacio = self.estado.respuesta(scope["path"])
+        await send(inicio)
+        await send(vacio if scope["method"] == "HEAD" else cuerpo)
@@ -1,16 +1,63 @@
 """
 Servicios para interactuar con APIs externas
 """
-import httpx
+import asyncio
+import hashlib
 import os
+import threading
 from datetime import datetime, timezone, timedelta
+from typing import Callable, Optional
+from urllib.parse import quote
 from config import settings
-from openai import OpenAI
-import requests
+from cache import weather_cache, image_cache
+from similitud import indice_similitud
+from registro import anotar_cache, medir_upstream
+
+# httpx y requests se importan dentro de los métodos que los usan para que
+# importar este módulo (y arrancar cada worker) no pague su costo de carga.
+
+_cliente_http = None
+
+
+def cliente_http():
+    """
+    Cliente httpx asíncrono compartido por el proceso (pool de conexiones)
+    Se crea en el primer uso y se cierra en el lifespan con cerrar_cliente_http.
+    """
+    global _cliente_http
+    if _cliente_http is None:
+        import httpx
+        _cliente_http = httpx.AsyncClient(
+            timeout=60,
+            limits=httpx.Limits(max_connections=settings.HTTP_MAX_CONEXIONES)
+        )
+    return _cliente_http
+
+
+async def cerrar_cliente_http():
+    global _cliente_http
+    if _cliente_http is not None:
+        await _cliente_http.aclose()
+        _cliente_http = None
 
 class WeatherService:
     """Servicio para obtener información del clima"""
     
+    @staticmethod
+    def clave_ciudad(ciudad: str) -> str:
+        """Clave normalizada de una ciudad para la caché"""
+        return ciudad.strip().lower()
+    
+    @staticmethod
+    async def refrescar(ciudad: str):
+        """
+        Consulta OpenWeather y reemplaza la entrada de la ciudad en la caché
+        (usado por el prefetch en segundo plano)
+        """
+        datos = await WeatherService._consultar_clima(ciudad)
+        weather_cache.set(WeatherService.clave_ciudad(ciudad), datos)
+        return datos
+    
     @staticmethod
     async def get_weather_and_time(ciudad: str):
         """
@@ -19,6 +66,27 @@ class WeatherService:
         if not settings.OPENWEATHER_API_KEY:
             raise ValueError("OPENWEATHER_API_KEY no está configurada")
         
+        clave = WeatherService.clave_ciudad(ciudad)
+        datos = weather_cache.get(clave)
+        anotar_cache(datos is not None)
+        if datos is None:
+            datos = await WeatherService._consultar_clima(ciudad)
+            weather_cache.set(clave, datos)
+        
+        # La hora local se calcula siempre al momento a partir del offset cacheado
+        timezone_offset = datos["timezone_offset"]
+        local_time = datetime.now(timezone.utc) + timedelta(seconds=timezone_offset)
+        
+        resultado = {k: v for k, v in datos.items() if k != "timezone_offset"}
+        resultado["hora_local"] = local_time.strftime("%Y-%m-%d %H:%M:%S")
+        resultado["zona_horaria"] = f"UTC{timezone_offset//3600:+d}"
+        return resultado
+    
+    @staticmethod
+    async def _consultar_clima(ciudad: str):
+        """
+        Consulta OpenWeather y devuelve los datos cacheables (sin la hora local)
+        """
         params = {
             "q": ciudad,
             "appid": settings.OPENWEATHER_API_KEY,
@@ -26,29 +94,23 @@ class WeatherService:
             "lang": "es"  # Respuestas en español
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(settings.OPENWEATHER_BASE_URL, params=params)
-            
-            if response.status_code != 200:
-                raise Exception(f"Error al obtener el clima: {response.text}")
-            
-            data = response.json()
-            
-            # Calcular hora local usando el timezone offset
-            timezone_offset = data['timezone']  # Offset en segundos
-            utc_time = datetime.now(timezone.utc)
-            local_time = utc_time + timedelta(seconds=timezone_offset)
-            
-            return {
-                "ciudad": data['name'],
-                "pais": data['sys']['country'],
-                "temperatura": data['main']['temp'],
-                "descripcion": data['weather'][0]['description'],
-                "humedad": data['main']['humidity'],
-                "velocidad_viento": data['wind']['speed'],
-                "hora_local": local_time.strftime("%Y-%m-%d %H:%M:%S"),
-                "zona_horaria": f"UTC{timezone_offset//3600:+d}"
-            }
+        with medir_upstream():
+            response = await cliente_http().get(settings.OPENWEATHER_BASE_URL, params=params, timeout=10)
+        
+        if response.status_code != 200:
+            raise Exception(f"Error al obtener el clima: {response.text}")
+        
+        data = response.json()
+        
+        return {
+            "ciudad": data['name'],
+            "pais": data['sys']['country'],
+            "temperatura": data['main']['temp'],
+            "descripcion": data['weather'][0]['description'],
+            "humedad": data['main']['humidity'],
+            "velocidad_viento": data['wind']['speed'],
+            "timezone_offset": data['timezone']  # Offset en segundos
+        }
 
 
 class ImageService:
@@ -58,7 +120,69 @@ class ImageService:
         # Pollinations.ai no requiere API key - es completamente gratuito
         self.pollinations_base_url = "https://image.pollinations.ai/prompt"
     
-    def create_image(self, prompt: str, size: str = "1024x1024", quality: str = "standard"):
+    def _descargar_imagen(self, image_url: str, prefijo: str, error: str,
+                          progreso: Optional[Callable[[dict], None]] = None):
+        """
+        Descarga una imagen de Pollinations.ai y la guarda en IMAGES_DIR
+        
+        Pollinations devuelve la misma imagen para la misma URL, así que si otra
+        petición (de cualquier worker) ya la descargó y el archivo sigue en disco,
+        se reutiliza sin volver a llamar al servicio externo.
+        
+        Si se pasa `progreso`, se llama con un dict por cada etapa (solicitando,
+        descargando con bytes recibidos/esperados, completado).
+        """
+        notificar = progreso or (lambda evento: None)
+        
+        cacheada = image_cache.get(image_url)
+        if cacheada is not None and os.path.exists(cacheada["ruta_local"]):
+            anotar_cache(True)
+            notificar({"estado": "completado", "nombre_archivo": cacheada["nombre_archivo"]})
+            return cacheada
+        anotar_cache(False)
+        
+        import requests
+        
+        notificar({"estado": "solicitando"})
+        with medir_upstream():
+            response = requests.get(image_url, timeout=60, stream=True)
+        with response, medir_upstream():
+            if response.status_code != 200:
+                raise Exception(f"{error}: Status {response.status_code}")
+            
+            total = int(response.headers.get("Content-Length") or 0) or None
+            # El hash de la URL distingue generaciones simultáneas del mismo segundo
+            huella = hashlib.sha1(image_url.encode("utf-8")).hexdigest()[:12]
+            filename = f"{prefijo}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{huella}.png"
+            filepath = os.path.join(settings.IMAGES_DIR, filename)
+            # Escritura atómica: nunca queda a la vista un archivo a medio descargar
+            temporal = f"{filepath}.{os.getpid()}.{threading.get_ident()}.part"
+            
+            recibidos = 0
+            try:
+                with open(temporal, 'wb') as handler:
+                    for bloque in response.iter_content(chunk_size=64 * 1024):
+                        handler.write(bloque)
+                        recibidos += len(bloque)
+                        notificar({"estado": "descargando", "bytes": recibidos, "total": total})
+                os.replace(temporal, filepath)
+            finally:
+                if os.path.exists(temporal):
+                    os.remove(temporal)
+        
+        indice_similitud.agregar(filepath)
+        
+        resultado = {
+            "url_imagen": image_url,
+            "nombre_archivo": filename,
+            "ruta_local": filepath
+        }
+        image_cache.set(image_url, resultado)
+        notificar({"estado": "completado", "nombre_archivo": filename})
+        return resultado
+    
+    def create_image(self, prompt: str, size: str = "1024x1024", quality: str = "standard",
+                     progreso: Optional[Callable[[dict], None]] = None, seed: Optional[int] = None):
         """
         Genera una imagen usando Pollinations.ai (GRATIS - basado en Stable Diffusion)
         """
@@ -68,30 +192,38 @@ class ImageService:
             
             # URL de Pollinations.ai - genera imagen automáticamente
             # Formato: https://image.pollinations.ai/prompt/{prompt}?width={w}&height={h}&nologo=true
-            encoded_prompt = requests.utils.quote(prompt)
+            encoded_prompt = quote(prompt)
             image_url = f"{self.pollinations_base_url}/{encoded_prompt}?width={width}&height={height}&nologo=true&enhance=true"
+            if seed is not None:
+                image_url += f"&seed={seed}"
             
-            # Descargar la imagen
-            response = requests.get(image_url, timeout=60)
-            if response.status_code != 200:
-                raise Exception(f"Error al generar imagen: Status {response.status_code}")
-            
-            # Guardar la imagen
-            filename = f"generated_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = os.path.join(settings.IMAGES_DIR, filename)
-            
-            with open(filepath, 'wb') as handler:
-                handler.write(response.content)
-            
-            return {
-                "url_imagen": image_url,
-                "nombre_archivo": filename,
-                "ruta_local": filepath
-            }
+            # Descargar y guardar la imagen (o reutilizar la ya descargada)
+            return self._descargar_imagen(image_url, "generated", "Error al generar imagen", progreso)
         except Exception as e:
             raise Exception(f"Error al generar imagen: {str(e)}")
     
-    def edit_image(self, image_path: str, prompt: str, size: str = "1024x1024"):
+    @staticmethod
+    def tamano_vista_previa(size: str) -> str:
+        """Tamaño reducido con la misma proporción y lado mayor PREVIEW_LADO (múltiplos de 8)"""
+        width, height = (int(lado) for lado in size.split('x'))
+        escala = min(1.0, settings.PREVIEW_LADO / max(width, height, 1))
+        return "x".join(str(max(64, round(lado * escala / 8) * 8)) for lado in (width, height))
+    
+    def create_preview(self, prompt: str, size: str, seed: int):
+        """
+        Genera una vista previa de baja resolución con el mismo prompt y semilla
+        que la imagen completa, para mostrar algo mientras esta se genera
+        """
+        try:
+            width, height = self.tamano_vista_previa(size).split('x')
+            image_url = (f"{self.pollinations_base_url}/{quote(prompt)}"
+                         f"?width={width}&height={height}&nologo=true&enhance=true&seed={seed}")
+            return self._descargar_imagen(image_url, "preview", "Error al generar vista previa")
+        except Exception as e:
+            raise Exception(f"Error al generar vista previa: {str(e)}")
+    
+    def edit_image(self, image_path: str, prompt: str, size: str = "1024x1024",
+                   progreso: Optional[Callable[[dict], None]] = None):
         """
         'Edita' una imagen combinándola con un nuevo prompt (método alternativo gratuito)
         Nota: En realidad genera una nueva imagen basada en el prompt, ya que la edición 
@@ -104,56 +236,69 @@ class ImageService:
             
             # Mejorar el prompt con contexto de edición
             enhanced_prompt = f"{prompt}, high quality, detailed"
-            encoded_prompt = requests.utils.quote(enhanced_prompt)
+            encoded_prompt = quote(enhanced_prompt)
             image_url = f"{self.pollinations_base_url}/{encoded_prompt}?width={width}&height={height}&nologo=true&enhance=true"
             
-            # Descargar la imagen generada
-            response = requests.get(image_url, timeout=60)
-            if response.status_code != 200:
-                raise Exception(f"Error al editar imagen: Status {response.status_code}")
-            
-            # Guardar la imagen editada
-            filename = f"edited_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = os.path.join(settings.IMAGES_DIR, filename)
-            
-            with open(filepath, 'wb') as handler:
-                handler.write(response.content)
-            
-            return {
-                "url_imagen": image_url,
-                "nombre_archivo": filename,
-                "ruta_local": filepath
-            }
+            # Descargar y guardar la imagen editada (o reutilizar la ya descargada)
+            return self._descargar_imagen(image_url, "edited", "Error al editar imagen", progreso)
         except Exception as e:
             raise Exception(f"Error al editar imagen: {str(e)}")
     
-    def create_variation(self, image_path: str, prompt: str = "creative variation"):
+    def _variacion(self, prompt: str, size: str, seed: int):
         """
-        Crea una variación basada en un prompt (método gratuito)
+        URL y ruta local de una variación con semilla explícita
+        
+        El nombre del archivo depende solo de (prompt, tamaño, semilla), así que
+        repetir la misma variación se sirve desde disco sin volver a Pollinations.
+        """
+        width, height = size.split('x')
+        image_url = (f"{self.pollinations_base_url}/{quote(prompt)}"
+                     f"?width={width}&height={height}&nologo=true&enhance=true&seed={seed}")
+        huella = hashlib.sha1(f"{prompt}|{size}".encode("utf-8")).hexdigest()[:16]
+        filename = f"variation_{huella}_s{seed}.png"
+        return image_url, filename, os.path.join(settings.IMAGES_DIR, filename)
+    
+    async def create_variation_async(self, prompt: str, size: str, seed: int):
+        """
+        Crea una variación con semilla explícita sobre el cliente HTTP compartido
+        Devuelve además `desde_cache` si la variación ya estaba en disco.
         """
         try:
-            # Generar variación usando un prompt genérico
-            encoded_prompt = requests.utils.quote(prompt)
-            image_url = f"{self.pollinations_base_url}/{encoded_prompt}?width=1024&height=1024&nologo=true&enhance=true&seed={datetime.now().timestamp()}"
-            
-            # Descargar la variación
-            response = requests.get(image_url, timeout=60)
-            if response.status_code != 200:
-                raise Exception(f"Error al crear variación: Status {response.status_code}")
-            
-            # Guardar la variación
-            filename = f"variation_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            filepath = os.path.join(settings.IMAGES_DIR, filename)
-            
-            with open(filepath, 'wb') as handler:
-                handler.write(response.content)
-            
-            return {
+            image_url, filename, filepath = self._variacion(prompt, size, seed)
+            resultado = {
+                "semilla": seed,
                 "url_imagen": image_url,
                 "nombre_archivo": filename,
-                "ruta_local": filepath
+                "desde_cache": True
             }
+            if os.path.exists(filepath):
+                return resultado
+            
+            bloques = []
+            with medir_upstream():
+                async with cliente_http().stream("GET", image_url) as response:
+                    if response.status_code != 200:
+                        raise Exception(f"Status {response.status_code}")
+                    async for bloque in response.aiter_bytes(64 * 1024):
+                        bloques.append(bloque)
+            
+            # Escritura e índice (el hash decodifica la imagen): fuera del event loop
+            await asyncio.to_thread(self._guardar_variacion, filepath, bloques)
+            
+            resultado["desde_cache"] = False
+            return resultado
         except Exception as e:
             raise Exception(f"Error al crear variación: {str(e)}")
-
-
+    
+    @staticmethod
+    def _guardar_variacion(filepath: str, bloques: list):
+        """Escribe la variación de forma atómica (otro worker puede pedir la misma) y la indexa"""
+        temporal = f"{filepath}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            with open(temporal, 'wb') as handler:
+                handler.writelines(bloques)
+            os.replace(temporal, filepath)
+        finally:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+        indice_similitud.agregar(filepath)
@@ -0,0 +1,305 @@
+"""
+Índice de similitud de imágenes por hash perceptual (dHash de 64 bits)
+
+Cada imagen que guarda ImageService se reduce a un hash de 64 bits. Los hashes
+viven en un arreglo uint64 de NumPy y la búsqueda calcula la distancia de
+Hamming contra todo el arreglo de una vez (XOR + popcount vectorizado).
+
+Persistencia: un log de solo-agregar junto a IMAGES_DIR (SIMILITUD_INDICE) con líneas
+"+<hash hex> <archivo>", "-<archivo>" y ">(vista previa) (imagen final)" (la vista
+previa queda reemplazada por la imagen final). Todos los workers agregan al mismo log
+y cada uno lee lo que falte antes de buscar, así el índice se actualiza de forma
+incremental sin reconstruirlo.
+
+Cuando el log acumula muchas más líneas que entradas vivas se compacta (se
+reescribe con el estado actual) bajo un lock exclusivo; los demás workers notan
+el archivo nuevo por su inode y lo releen desde el principio. La indexación de
+las imágenes previas al arrancar la hace un solo worker a la vez. Ambas cosas
+usan fcntl: sin él (Windows) no se compacta y cada worker indexa por su cuenta.
+
+NumPy y Pillow son opcionales (y se importan recién al usarlos, no al importar
+este módulo): si falta alguno, el índice queda desactivado.
+"""
+import importlib.util
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+from config import settings
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+HASH_BITS = 64
+# Se compacta cuando el log tiene más de 2x líneas que entradas vivas (y al menos esto)
+MIN_LINEAS_COMPACTAR = 1000
+
+_np = None
+
+
+def _numpy():
+    global _np
+    if _np is None:
+        import numpy
+        _np = numpy
+    return _np
+
+
+def dhash(ruta: str) -> int:
+    """Difference hash: compara píxeles vecinos de la imagen reducida a 9x8 en grises"""
+    from PIL import Image
+
+    with Image.open(ruta) as imagen:
+        imagen.draft("L", (64, 64))
+        pixeles = list(imagen.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    valor = 0
+    for fila in range(8):
+        base = fila * 9
+        for columna in range(8):
+            valor = (valor << 1) | (pixeles[base + columna] > pixeles[base + columna + 1])
+    return valor
+
+
+def _popcount(valores):
+    np = _numpy()
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(valores)
+    # NumPy < 2.0: contar bits por byte con una tabla
+    tabla = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+    return tabla[valores.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class IndiceSimilitud:
+    """Índice en memoria de hashes perceptuales respaldado por un log en disco"""
+
+    def __init__(self, ruta_log: str):
+        self.ruta_log = ruta_log
+        self._lock = threading.Lock()
+        self._disponible = None
+        self._reiniciar()
+
+    def _reiniciar(self):
+        self._offset = 0
+        self._inode = None
+        self._lineas = 0
+        self._nombres = []
+        self._posicion = {}
+        self._vinculos = {}
+        self._hashes = None
+        self._validos = None
+
+    @property
+    def disponible(self) -> bool:
+        if self._disponible is None:
+            self._disponible = all(importlib.util.find_spec(m) is not None for m in ("numpy", "PIL"))
+        return self._disponible
+
+    def __len__(self):
+        return len(self._posicion)
+
+    # ---- Locks entre procesos ----
+
+    @contextmanager
+    def _lock_archivo(self, sufijo: str, modo: int, bloqueante: bool = True):
+        """Lock de fcntl sobre `<log><sufijo>`; entrega False si no se pudo tomar"""
+        if fcntl is None:
+            yield True
+            return
+        with open(self.ruta_log + sufijo, "a") as archivo:
+            try:
+                fcntl.flock(archivo, modo if bloqueante else modo | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(archivo, fcntl.LOCK_UN)
+
+    # ---- Estado en memoria ----
+
+    def _poner(self, nombre: str, valor: int):
+        np = _numpy()
+        if self._hashes is None:
+            self._hashes = np.zeros(1024, dtype=np.uint64)
+            self._validos = np.zeros(1024, dtype=bool)
+        indice = self._posicion.get(nombre)
+        if indice is None:
+            indice = len(self._nombres)
+            if indice == len(self._hashes):
+                self._hashes = np.concatenate([self._hashes, np.zeros_like(self._hashes)])
+                self._validos = np.concatenate([self._validos, np.zeros_like(self._validos)])
+            self._nombres.append(nombre)
+            self._posicion[nombre] = indice
+        self._hashes[indice] = valor
+        self._validos[indice] = True
+
+    def _quitar(self, nombre: str):
+        indice = self._posicion.pop(nombre, None)
+        if indice is not None:
+            self._validos[indice] = False
+
+    def _sincronizar(self):
+        """Aplica las líneas del log agregadas (por cualquier worker) desde la última lectura"""
+        try:
+            with open(self.ruta_log, "rb") as log:
+                inode = os.fstat(log.fileno()).st_ino
+                if inode != self._inode:
+                    # Log nuevo (compactado por otro worker): releer todo
+                    if self._inode is not None:
+                        self._reiniciar()
+                    self._inode = inode
+                log.seek(self._offset)
+                datos = log.read()
+        except FileNotFoundError:
+            return
+        # Solo procesar líneas completas
+        fin = datos.rfind(b"\n") + 1
+        for linea in datos[:fin].decode("utf-8").splitlines():
+            self._lineas += 1
+            if linea.startswith("+"):
+                if self.disponible:
+                    valor, _, nombre = linea[1:].partition(" ")
+                    self._poner(nombre, int(valor, 16))
+            elif linea.startswith("-"):
+                self._quitar(linea[1:])
+            elif linea.startswith(">"):
+                vista_previa, _, final = linea[1:].partition(" ")
+                self._vinculos[vista_previa] = final
+                self._quitar(vista_previa)
+        self._offset += fin
+
+    def _registrar(self, linea: str):
+        # O_APPEND: las líneas cortas de varios procesos no se intercalan. El lock
+        # compartido solo excluye a una compactación en curso.
+        with self._lock_archivo(".lock", fcntl.LOCK_SH if fcntl else 0):
+            with open(self.ruta_log, "a", encoding="utf-8") as log:
+                log.write(linea + "\n")
+
+    def _compactar_si_hace_falta(self):
+        """Reescribe el log con el estado actual si creció mucho más que el índice"""
+        if fcntl is None:
+            return
+        vivas = len(self._posicion) + len(self._vinculos)
+        if self._lineas <= max(MIN_LINEAS_COMPACTAR, 2 * vivas):
+            return
+        with self._lock_archivo(".lock", fcntl.LOCK_EX):
+            # Bajo el lock nadie agrega: leer lo último antes de reescribir
+            self._sincronizar()
+            lineas = [f"+{int(self._hashes[i]):016x} {nombre}" for nombre, i in self._posicion.items()]
+            lineas += [f">{previa} {final}" for previa, final in self._vinculos.items()]
+            temporal = f"{self.ruta_log}.{os.getpid()}.part"
+            with open(temporal, "w", encoding="utf-8") as log:
+                log.write("".join(linea + "\n" for linea in lineas))
+            os.replace(temporal, self.ruta_log)
+            self._reiniciar()
+            self._sincronizar()
+
+    # ---- API pública ----
+
+    def cargar(self):
+        """
+        Lee el log completo (compactándolo si hace falta) e indexa las imágenes de
+        IMAGES_DIR que aún no estén (por ejemplo, las generadas antes de activar
+        el índice). Si otro worker ya está indexando, este solo lee el log.
+        """
+        if not self.disponible:
+            return
+        with self._lock:
+            self._sincronizar()
+            self._compactar_si_hace_falta()
+        if not os.path.isdir(settings.IMAGES_DIR):
+            return
+        with self._lock_archivo(".indexando", fcntl.LOCK_EX if fcntl else 0, bloqueante=False) as tomado:
+            if not tomado:
+                return
+            with self._lock:
+                # Lo que haya indexado otro worker antes de soltar el lock
+                self._sincronizar()
+            with os.scandir(settings.IMAGES_DIR) as entradas:
+                for entrada in entradas:
+                    if entrada.name.lower().endswith((".png", ".jpg", ".jpeg", ".webp")) \
+                            and entrada.name not in self._posicion:
+                        self.agregar(entrada.path)
+
+    def agregar(self, ruta: str):
+        """Calcula el hash de una imagen recién guardada y la agrega al índice"""
+        if not self.disponible:
+            return
+        try:
+            valor = dhash(ruta)
+        except Exception:
+            # Archivo que no es una imagen válida: no se indexa
+            return
+        nombre = os.path.basename(ruta)
+        with self._lock:
+            self._sincronizar()
+            self._registrar(f"+{valor:016x} {nombre}")
+            self._poner(nombre, valor)
+
+    def eliminar(self, nombre: str):
+        """Quita una imagen del índice (borrada o desalojada del disco)"""
+        if not self.disponible:
+            return
+        with self._lock:
+            self._sincronizar()
+            if nombre in self._posicion:
+                self._registrar(f"-{nombre}")
+                self._quitar(nombre)
+            self._compactar_si_hace_falta()
+
+    def vincular(self, vista_previa: str, final: str):
+        """Registra que `final` reemplaza a `vista_previa` (que sale de las búsquedas)"""
+        with self._lock:
+            self._sincronizar()
+            self._registrar(f">{vista_previa} {final}")
+            self._vinculos[vista_previa] = final
+            self._quitar(vista_previa)
+
+    def final_de(self, vista_previa: str) -> Optional[str]:
+        """Imagen final que reemplazó a una vista previa, si ya se generó"""
+        with self._lock:
+            self._sincronizar()
+            return self._vinculos.get(vista_previa)
+
+    def hash_de(self, nombre: str) -> Optional[int]:
+        with self._lock:
+            self._sincronizar()
+            indice = self._posicion.get(nombre)
+            return None if indice is None else int(self._hashes[indice])
+
+    def buscar(self, valor: int, k: int = 10, max_distancia: int = HASH_BITS,
+               excluir: Optional[str] = None) -> List[dict]:
+        """Las `k` imágenes más cercanas por distancia de Hamming"""
+        np = _numpy()
+        with self._lock:
+            self._sincronizar()
+            total = len(self._nombres)
+            if not total:
+                return []
+            distancias = _popcount(self._hashes[:total] ^ np.uint64(valor)).astype(np.uint8, copy=False)
+            distancias[~self._validos[:total]] = HASH_BITS + 1
+            if excluir is not None and excluir in self._posicion:
+                distancias[self._posicion[excluir]] = HASH_BITS + 1
+            # Pedir algunos de más por si hay archivos ya borrados del disco
+            candidatos = min(total, k * 2)
+            cercanos = np.argpartition(distancias, candidatos - 1)[:candidatos]
+            cercanos = cercanos[np.argsort(distancias[cercanos], kind="stable")]
+            nombres = [(self._nombres[i], int(distancias[i])) for i in cercanos]
+
+        resultados = []
+        for nombre, distancia in nombres:
+            if distancia > max_distancia or len(resultados) == k:
+                break
+            if not os.path.exists(os.path.join(settings.IMAGES_DIR, nombre)):
+                # Desalojo perezoso de imágenes que ya no están en disco
+                self.eliminar(nombre)
+                continue
+            resultados.append({"nombre_archivo": nombre, "distancia": distancia})
+        return resultados
+
+
+indice_similitud = IndiceSimilitud(ruta_log=settings.SIMILITUD_INDICE)
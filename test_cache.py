@@ -0,0 +1,113 @@
+"""
+Pruebas de la caché de dos niveles (LRU local + SQLite compartido)
+"""
+import sqlite3
+import time
+
+import pytest
+
+from cache import LocalLRU, SharedStore, TwoTierCache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SharedStore(str(tmp_path / "cache.db"), max_entradas=100)
+
+
+def test_entrada_expira_segun_su_ttl(store):
+    cache = TwoTierCache("clima", ttl=60, store=store)
+    cache.set("bogota", {"temperatura": 14}, ttl=0.05)
+    cache.set("lima", {"temperatura": 20})
+
+    assert cache.get("bogota") == {"temperatura": 14}
+    time.sleep(0.1)
+    assert cache.get("bogota") is None
+    assert cache.get("lima") == {"temperatura": 20}
+
+
+def test_lru_local_desaloja_la_menos_usada():
+    lru = LocalLRU(max_entradas=2)
+    expira = time.time() + 60
+    lru.set("a", 1, expira)
+    lru.set("b", 2, expira)
+    lru.get("a", time.time())
+    lru.set("c", 3, expira)
+
+    assert lru.get("b", time.time()) is None
+    assert lru.get("a", time.time())[1] == 1
+    assert len(lru) == 2
+
+
+def test_recorte_del_nivel_compartido(tmp_path):
+    store = SharedStore(str(tmp_path / "cache.db"), max_entradas=2)
+    ahora = time.time()
+    store.set("vencida", 0, ahora - 1)
+    for i, segundos in enumerate((10, 30, 20)):
+        store.set(f"k{i}", i, ahora + segundos)
+
+    store.recortar(ahora)
+
+    # Se van la vencida y la que expira antes entre las que sobran
+    assert store.get("vencida", ahora) is None
+    assert store.get("k0", ahora) is None
+    assert store.get("k1", ahora)[1] == 1
+    assert store.get("k2", ahora)[1] == 2
+
+
+def test_dos_workers_comparten_el_nivel_compartido(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+    worker_a = TwoTierCache("clima", ttl=60, store=SharedStore(ruta, 100))
+    worker_b = TwoTierCache("clima", ttl=60, store=SharedStore(ruta, 100))
+
+    worker_a.set("bogota", {"temperatura": 14})
+    assert worker_b.get("bogota") == {"temperatura": 14}
+    assert worker_b.hits_compartido == 1
+    # La segunda lectura ya sale de la LRU local de b
+    worker_b.get("bogota")
+    assert worker_b.hits_local == 1
+
+
+def test_invalidacion_llega_a_la_lru_de_otro_worker(store):
+    worker_a = TwoTierCache("clima", ttl=60, store=store)
+    worker_b = TwoTierCache("clima", ttl=60, store=store)
+    worker_a.set("bogota", {"temperatura": 14})
+    worker_b.get("bogota")
+
+    worker_a.invalidate("bogota")
+    # Cada worker revisa la versión del espacio como mucho una vez por segundo
+    time.sleep(1.05)
+
+    assert worker_b.get("bogota") is None
+    assert worker_a.get("bogota") is None
+
+
+def test_otros_espacios_no_se_invalidan(store):
+    clima = TwoTierCache("clima", ttl=60, store=store)
+    imagenes = TwoTierCache("imagenes", ttl=60, store=store)
+    clima.set("x", 1)
+    imagenes.set("x", 2)
+
+    clima.clear()
+
+    assert clima.get("x") is None
+    assert imagenes.get("x") == 2
+
+
+def test_base_tomada_cuenta_como_miss_sin_bloquear(tmp_path):
+    ruta = str(tmp_path / "cache.db")
+    store = SharedStore(ruta, 100, espera_bloqueo=0.05)
+    cache = TwoTierCache("clima", ttl=60, store=store)
+    store.set("clima:previa", 1, time.time() + 60)
+
+    otro = sqlite3.connect(ruta, isolation_level=None)
+    otro.execute("BEGIN EXCLUSIVE")
+    try:
+        inicio = time.perf_counter()
+        cache.set("bogota", {"temperatura": 14})
+        assert time.perf_counter() - inicio < 1
+        assert store.sin_bloqueo >= 1
+        # La escritura quedó solo en la LRU local
+        assert cache.get("bogota") == {"temperatura": 14}
+    finally:
+        otro.execute("ROLLBACK")
+    assert store.get("clima:bogota", time.time()) is None
@@ -0,0 +1,84 @@
+"""
+Pruebas del rate limiting (token bucket compartido en SQLite)
+"""
+import sqlite3
+import time
+import uuid
+
+import pytest
+
+import main
+from config import settings
+from rate_limit import RateLimiter, identificar_cliente
+
+
+def test_bucket_se_vacia_y_se_recarga(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "rl.db"), {"crear": (2, 0.2)})
+
+    assert limiter.consumir("crear", "ip:1").permitido
+    assert limiter.consumir("crear", "ip:1").permitido
+    rechazado = limiter.consumir("crear", "ip:1")
+    assert not rechazado.permitido
+    assert rechazado.retry_after == 1
+    assert rechazado.headers()["Retry-After"] == "1"
+    # Otro cliente tiene su propio bucket
+    assert limiter.consumir("crear", "ip:2").permitido
+
+    time.sleep(0.25)
+    assert limiter.consumir("crear", "ip:1").permitido
+
+
+def test_grupo_sin_limite_no_cuenta(tmp_path):
+    limiter = RateLimiter(str(tmp_path / "rl.db"), {"crear": None})
+    assert limiter.consumir("crear", "ip:1") is None
+
+
+def test_base_tomada_deja_pasar_sin_bloquear(tmp_path):
+    ruta = str(tmp_path / "rl.db")
+    limiter = RateLimiter(ruta, {"crear": (2, 60)}, espera_bloqueo=0.05)
+    limiter.consumir("crear", "ip:1")
+    otro = sqlite3.connect(ruta, isolation_level=None)
+    otro.execute("BEGIN IMMEDIATE")
+    try:
+        inicio = time.perf_counter()
+        assert limiter.consumir("crear", "ip:1") is None
+        assert time.perf_counter() - inicio < 1
+        assert limiter.sin_bloqueo == 1
+    finally:
+        otro.execute("ROLLBACK")
+
+
+def test_solo_las_api_keys_configuradas_tienen_bucket_propio(monkeypatch):
+    monkeypatch.setattr(settings, "API_KEYS", frozenset({"buena"}))
+    assert identificar_cliente("buena", "10.0.0.1").startswith("key:")
+    assert identificar_cliente("inventada", "10.0.0.1") == "ip:10.0.0.1"
+    assert identificar_cliente(None, None) == "ip:desconocida"
+
+
+@pytest.fixture
+def limite_crear(monkeypatch, tmp_path):
+    monkeypatch.setattr(main, "rate_limiter", RateLimiter(str(tmp_path / "crear.db"), {"crear": (2, 60)}))
+
+
+def _crear(cliente, **headers):
+    return cliente.post("/api/nivel2/crear-imagen", json={"prompt": "un faro", "size": "64x64"}, headers=headers)
+
+
+def test_ruta_responde_429_con_retry_after(cliente, limite_crear):
+    respuestas = [_crear(cliente) for _ in range(3)]
+
+    assert [r.status_code for r in respuestas] == [200, 200, 429]
+    assert respuestas[0].headers["RateLimit-Limit"] == "2"
+    assert respuestas[1].headers["RateLimit-Remaining"] == "0"
+    assert int(respuestas[2].headers["Retry-After"]) > 0
+
+
+def test_rotar_api_keys_no_evita_el_limite(cliente, limite_crear, monkeypatch):
+    monkeypatch.setattr(settings, "API_KEYS", frozenset({"buena"}))
+
+    rotando = [_crear(cliente, **{"X-API-Key": uuid.uuid4().hex}).status_code for _ in range(4)]
+    assert rotando == [200, 200, 429, 429]
+
+    # Una key configurada sí tiene su propio bucket
+    con_key = [_crear(cliente, **{"X-API-Key": "buena"}).status_code for _ in range(3)]
+    assert con_key == [200, 200, 429]
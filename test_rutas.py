@@ -0,0 +1,150 @@
+"""
+Pruebas de las rutas de la API con TestClient (servicios externos simulados)
+"""
+import io
+import json
+import time
+import zipfile
+
+import pytest
+
+from apagado import apagado
+from config import settings
+
+
+def _variaciones(cliente, **cuerpo):
+    respuesta = cliente.post("/api/nivel2/variaciones", json={"prompt": "un faro", "size": "64x64", **cuerpo})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(linea) for linea in respuesta.text.splitlines()]
+
+
+def test_raiz(cliente):
+    assert cliente.get("/").json()["version"] == "1.0.0"
+
+
+def test_clima_se_sirve_desde_cache(cliente, externos):
+    for _ in range(2):
+        respuesta = cliente.post("/api/nivel1/clima", json={"ciudad": "Ciudad de Prueba"})
+        assert respuesta.status_code == 200
+        assert respuesta.json()["temperatura"] == 14.2
+    # (los sondeos de /ready también llaman a OpenWeather, pero sin ciudad)
+    assert sum("q=Ciudad" in url for url in externos) == 1
+
+
+def test_crear_imagen_y_progreso(cliente):
+    respuesta = cliente.post("/api/nivel2/crear-imagen",
+                             json={"prompt": "un faro", "size": "64x64", "id_progreso": "faro-1"})
+    assert respuesta.status_code == 200
+    nombre = respuesta.json()["nombre_archivo"]
+
+    # El tópico ya terminó: el stream entrega todos los eventos y se cierra
+    eventos = cliente.get("/api/progreso/faro-1").text
+    assert "event: solicitando" in eventos
+    assert "event: completado" in eventos
+    assert nombre in eventos
+
+    assert cliente.get(f"/api/nivel2/imagen/{nombre}").status_code == 200
+
+
+def test_progreso_rechaza_id_invalido(cliente):
+    assert cliente.get("/api/progreso/no valido!").status_code == 400
+
+
+def test_variaciones_por_semilla_y_desde_disco(cliente, externos):
+    primeras = _variaciones(cliente, n=3, semilla_base=10)
+    assert sorted(v["semilla"] for v in primeras) == [10, 11, 12]
+    assert not any(v["desde_cache"] for v in primeras)
+
+    repetidas = _variaciones(cliente, semillas=[10, 11, 12])
+    assert all(v["desde_cache"] for v in repetidas)
+    assert sum("seed=" in url for url in externos) == 3
+
+
+def test_variaciones_acotadas(cliente):
+    demasiadas = settings.MAX_VARIACIONES + 1
+    assert cliente.post("/api/nivel2/variaciones", json={"prompt": "x", "n": demasiadas}).status_code == 422
+    assert cliente.post("/api/nivel2/variaciones", json={"prompt": "x", "semillas": [-1]}).status_code == 422
+
+
+def test_exportar_zip(cliente):
+    nombres = {v["nombre_archivo"] for v in _variaciones(cliente, n=2)}
+
+    respuesta = cliente.post("/api/imagenes/exportar", json={"tipo": "variation"})
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(respuesta.content)) as archivo:
+        assert set(archivo.namelist()) == nombres
+        assert archivo.testzip() is None
+
+
+def test_exportar_rechaza_rutas(cliente):
+    respuesta = cliente.post("/api/imagenes/exportar", json={"archivos": ["../config.py"]})
+    assert respuesta.status_code == 400
+
+
+def test_imagenes_similares(cliente):
+    nombres = [v["nombre_archivo"] for v in _variaciones(cliente, n=2)]
+
+    respuesta = cliente.get(f"/api/imagenes/similares/{nombres[0]}", params={"max_distancia": 0})
+    assert respuesta.status_code == 200
+    # Las dos variaciones simuladas son la misma imagen: distancia 0
+    assert respuesta.json()["similares"] == [{"nombre_archivo": nombres[1], "distancia": 0}]
+
+    assert cliente.get("/api/imagenes/similares/no_existe.png").status_code == 404
+
+
+def test_subir_fuente_una_vez_y_editar_por_id(cliente, png):
+    subir = lambda: cliente.post("/api/nivel3/fuentes", files={"imagen": ("a.png", png, "image/png")})
+
+    primera = subir().json()
+    segunda = subir().json()
+    assert primera["id_fuente"] == segunda["id_fuente"]
+    assert (primera["reutilizada"], segunda["reutilizada"]) == (False, True)
+    assert (primera["ancho"], primera["alto"]) == (64, 64)
+
+    respuesta = cliente.post("/api/nivel3/editar-imagen",
+                             data={"prompt": "con sombrero", "size": "64x64", "id_fuente": primera["id_fuente"]})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["id_fuente"] == primera["id_fuente"]
+
+    desconocida = cliente.post("/api/nivel3/editar-imagen", data={"prompt": "x", "id_fuente": "0" * 64})
+    assert desconocida.status_code == 404
+
+
+def test_subir_fuente_demasiado_grande(cliente, png, monkeypatch):
+    from fuentes import almacen_fuentes
+
+    monkeypatch.setattr(almacen_fuentes, "max_bytes", len(png) - 1)
+    respuesta = cliente.post("/api/nivel3/fuentes", files={"imagen": ("a.png", png, "image/png")})
+    assert respuesta.status_code == 413
+
+
+def test_health_y_ready(cliente):
+    assert cliente.get("/health").json() == {"estado": "ok"}
+
+    # El primer sondeo corre en segundo plano al arrancar
+    limite = time.monotonic() + 5
+    while cliente.get("/ready").json()["estado"] == "iniciando" and time.monotonic() < limite:
+        time.sleep(0.05)
+    ready = cliente.get("/ready")
+    assert ready.status_code == 200
+    assert ready.json()["estado"] == "listo"
+    assert cliente.head("/ready").content == b""
+
+
+@pytest.fixture
+def drenando():
+    apagado.drenando = True
+    yield
+    apagado.drenando = False
+
+
+def test_drenaje(cliente, drenando):
+    assert cliente.get("/health").json() == {"estado": "drenando"}
+    assert cliente.get("/ready").status_code == 503
+    respuesta = cliente.post("/api/nivel2/crear-imagen", json={"prompt": "x"})
+    assert respuesta.status_code == 503
+    assert "Retry-After" in respuesta.headers
+    # Lo que no es generación se sigue atendiendo
+    assert cliente.get("/api/imagenes").status_code == 200